@@ -1,5 +1,14 @@
+import asyncio
+import functools
 import json
+import operator
 import os
+import re
+import threading
+import time
+import weakref
+from array import array
+from typing import Final, NamedTuple
 import vertexai
 import google.auth
 from vertexai import generative_models
@@ -12,16 +21,48 @@ from vertexai.generative_models import (
 )
 
 from google.cloud import storage
-from google.api_core.exceptions import Conflict
+from google.cloud.storage import transfer_manager
+from google.api_core.exceptions import Conflict, Forbidden, PreconditionFailed
 from google.oauth2 import service_account
 from dotenv import load_dotenv
 # from google.cloud import texttospeech
 
+from engines.gemini_engine import GeminiTranslator
+
 load_dotenv()
 
+# Resolved once at import; these do not change for the life of the process.
+_GCP_REGION = os.environ.get("GCP_REGION", "us-central1")
+_SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+}
+
+_VERTEX_READY = False
+_init_lock = threading.Lock()
+
+# Fixed preamble of the ASR guidance block; format with limit/total token counts.
+_ASR_GUIDANCE_HEADER = "\n".join([
+    "ASR_GUIDANCE: This is the canonical ASR word sequence. Use contiguous spans of these token indexes to anchor each utterance.",
+    "For each utterance, return TokenStart and TokenEnd as inclusive indexes into this sequence.",
+    "If you cannot confidently align, set both indexes to -1.",
+    "Token count provided: {limit} of {total} (0-based indexes).",
+    "Format: i=INDEX; w=WORD",
+])
+
+# ASR token normalization: drop punctuation, collapse whitespace
+_NORM_RE1 = re.compile(r"[^a-z0-9\s]")
+_NORM_RE2 = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1)
 def _resolve_project_id() -> str | None:
     """Resolve active GCP project id with precedence:
     1) PROJECT_ID env, 2) GOOGLE_CLOUD_PROJECT, 3) GCLOUD_PROJECT, 4) ADC default()
+
+    Memoized: the ADC lookup touches the filesystem and possibly the metadata server.
     """
     pid = (
         os.environ.get("PROJECT_ID")
@@ -37,153 +78,321 @@ def _resolve_project_id() -> str | None:
         return None
 
 def _ensure_vertexai_init():
-    pid = _resolve_project_id()
-    loc = os.environ.get("GCP_REGION", "us-central1")
-    if pid and loc:
-        try:
-            vertexai.init(project=pid, location=loc)
-        except Exception:
-            pass
-    else:
-        print("Warning: Could not resolve PROJECT_ID/GCP_REGION for Vertex AI initialization")
-
+    global _VERTEX_READY
+    if _VERTEX_READY:
+        return
+    with _init_lock:
+        if _VERTEX_READY:
+            return
+        pid = _resolve_project_id()
+        loc = _GCP_REGION
+        if pid and loc:
+            try:
+                vertexai.init(project=pid, location=loc)
+                _VERTEX_READY = True
+            except Exception:
+                pass
+        else:
+            print("Warning: Could not resolve PROJECT_ID/GCP_REGION for Vertex AI initialization")
 
 # -------------------------------
 # Internal GCS helper utilities
 # -------------------------------
+# Files at or above this size go through parallel XML multipart upload; smaller
+# files are faster as a single request.
+_CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024
+_CHUNKED_UPLOAD_ATTEMPTS = 3
+
+# Bucket handles keyed by (project_id, bucket_name); reload()/create only run on first use.
+_BUCKETS: dict[tuple[str, str], storage.Bucket] = {}
+# (bucket_name, prefix) pairs whose folder placeholder is known to exist.
+_ENSURED_PREFIXES: set[tuple[str, str]] = set()
+
+
+@functools.lru_cache(maxsize=4)
+def _get_client(project_id: str) -> storage.Client:
+    return storage.Client(project=project_id)
+
+
 def _get_or_create_bucket(project_id: str | None, preferred_bucket: str | None = None) -> storage.Bucket:
     """Get or create a GCS bucket for Gemini assets.
 
     Bucket name resolution order:
       1) preferred_bucket (env GEMINI_ASSETS_BUCKET)
       2) f"{project_id}-gemini-assets"
+
+    The client and bucket handle are cached, so repeated calls skip the round-trips.
     """
     if not project_id:
         raise ValueError("Could not resolve PROJECT_ID. Set PROJECT_ID in .env or run 'gcloud auth application-default login' and ensure a default project is set.")
-    client = storage.Client(project=project_id)
     # Respect BUCKET_NAME from .env if provided
     env_bucket = os.environ.get("BUCKET_NAME")
     bucket_name = preferred_bucket or env_bucket or os.environ.get("GEMINI_ASSETS_BUCKET") or f"{project_id}-gemini-assets"
-    bucket = client.bucket(bucket_name)
+    cached = _BUCKETS.get((project_id, bucket_name))
+    if cached is not None:
+        return cached
+    client = _get_client(project_id)
+    # Optimistic create: one request either creates the bucket or tells us it already exists.
+    # Conflict also covers a name owned by another project; the first upload then fails
+    # with a permission error naming the bucket.
     try:
-        bucket.reload()
-        return bucket
-    except Exception as e:
-        # If user explicitly specified BUCKET_NAME and it doesn't exist or is inaccessible,
-        # attempt creation; if name is globally taken, raise a clear error.
-        try:
-            location = os.environ.get("GCP_REGION", "us-central1")
-            bucket = client.create_bucket(bucket_name, location=location)
-            return bucket
-        except Conflict:
-            raise ValueError(
-                "BUCKET_NAME is set to a globally unavailable bucket name. "
-                f"Tried to create '{bucket_name}' but it already exists in another project. "
-                "Please set BUCKET_NAME in .env to a unique name (e.g., '<project>-assets-<random>') "
-                "and update INPUT_FOLDER/OUTPUT_FOLDER accordingly, or use an existing bucket you control."
-            ) from None
-
-
-def _upload_file_to_bucket(local_path: str, bucket: storage.Bucket, object_name: str | None = None) -> str:
-    from pathlib import Path
-    # Use INPUT_FOLDER as a prefix if provided. Accept either:
+        bucket = client.create_bucket(bucket_name, location=_GCP_REGION)
+    except (Conflict, Forbidden):
+        # Existing bucket, or no create permission on an existing one: use it as-is
+        bucket = client.bucket(bucket_name)
+    _BUCKETS[(project_id, bucket_name)] = bucket
+    return bucket
+
+
+@functools.lru_cache(maxsize=None)
+def _input_prefix(input_folder: str | None) -> str | None:
+    # INPUT_FOLDER as an object prefix. Accept either:
     # - "gs://bucket/prefix" (bucket part ignored; BUCKET_NAME is authoritative)
     # - "prefix" (folder name under the selected bucket)
-    input_folder = os.environ.get("INPUT_FOLDER")
-    prefix = None
-    if input_folder:
-        if input_folder.startswith("gs://"):
-            # Parse gs://bucket/prefix
-            try:
-                _, path = input_folder.split("gs://", 1)
-                parts = path.split("/", 1)
-                in_prefix = parts[1] if len(parts) > 1 else ""
-                prefix = in_prefix.strip("/") or None
-            except Exception:
-                prefix = None
-        else:
-            prefix = input_folder.strip("/") or None
+    if not input_folder:
+        return None
+    if input_folder.startswith("gs://"):
+        # Parse gs://bucket/prefix
+        try:
+            _, path = input_folder.split("gs://", 1)
+            parts = path.split("/", 1)
+            in_prefix = parts[1] if len(parts) > 1 else ""
+            return in_prefix.strip("/") or None
+        except Exception:
+            return None
+    return input_folder.strip("/") or None
+
 
+def _upload_file_to_bucket(
+    local_path: str, bucket: storage.Bucket, object_name: str | None = None, prefix: str | None = None
+) -> str:
+    from pathlib import Path
     base_name = object_name or Path(local_path).name
     obj_name = f"{prefix}/{base_name}" if prefix else base_name
     # Ensure the GCS "folder" exists (optional, for UI convenience)
     if prefix:
         _ensure_prefix_exists(bucket, prefix)
     blob = bucket.blob(obj_name)
-    blob.upload_from_filename(local_path)
+    if os.path.getsize(local_path) >= _CHUNKED_UPLOAD_THRESHOLD:
+        _upload_chunks_with_retry(local_path, blob)
+    else:
+        blob.upload_from_filename(local_path)
     return f"gs://{bucket.name}/{obj_name}"
 
 
+def _upload_chunks_with_retry(local_path: str, blob: storage.Blob) -> None:
+    """Upload a large file as concurrent 32 MiB parts, retrying the whole upload with backoff.
+
+    A retry starts a fresh multipart session, which recovers from the
+    NoSuchUpload race when a session is finalized or aborted mid-flight.
+    """
+    max_workers = min(16, (os.cpu_count() or 1) * 2)
+    for attempt in range(_CHUNKED_UPLOAD_ATTEMPTS):
+        try:
+            transfer_manager.upload_chunks_concurrently(
+                local_path,
+                blob,
+                chunk_size=_CHUNKED_UPLOAD_THRESHOLD,
+                max_workers=max_workers,
+                # Threads, not the default fork-based processes: gRPC channels may be open here
+                worker_type=transfer_manager.THREAD,
+            )
+            return
+        except Exception:
+            if attempt == _CHUNKED_UPLOAD_ATTEMPTS - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
 def _ensure_prefix_exists(bucket: storage.Bucket, prefix: str) -> None:
     """Create a zero-byte placeholder object to mimic a folder in GCS."""
+    key = (bucket.name, prefix)
+    if key in _ENSURED_PREFIXES:
+        return
     placeholder = f"{prefix.rstrip('/')}/"
     blob = bucket.blob(placeholder)
-    if not blob.exists():
-        try:
-            blob.upload_from_string("")
-        except Exception:
-            pass
+    # Create-if-absent in one request; 412 means the placeholder is already there
+    try:
+        blob.upload_from_string("", if_generation_match=0)
+    except PreconditionFailed:
+        pass
+    except Exception:
+        return
+    _ENSURED_PREFIXES.add(key)
 
-def generate(parts, response_schema=None):
-    """Wrapper around model.generate_content with sane defaults.
 
-        # Ensure the "folder" exists by writing a placeholder if needed
-        if prefix:
-            _ensure_prefix_exists(bucket, prefix)
-    - Coerces any plain-text parts into Part.from_text to avoid proto parsing issues.
-    - Leaves binary/URI parts as-is.
-    """
-    _ensure_vertexai_init()
-    model = GenerativeModel("gemini-2.5-flash")
-    def _ensure_prefix_exists(bucket: storage.Bucket, prefix: str) -> None:
-        """Create a zero-byte placeholder for a GCS prefix to mimic folder existence."""
-        # GCS doesn't need folders, but some UIs prefer a placeholder object ending with '/'
-        placeholder = f"{prefix.rstrip('/')}/"
-        blob = bucket.blob(placeholder)
-        # Only create if it doesn't exist
-        if not blob.exists():
-            try:
-                blob.upload_from_string("")
-            except Exception:
-                # Non-fatal if we can't create the placeholder
-                pass
+_DEFAULT_MODEL = "gemini-2.5-flash"
+_MODEL_CACHE: dict[str, GenerativeModel] = {}
+# The async gRPC client is cached on the model and bound to the loop that created it, so
+# async callers get one model per running loop (a later asyncio.run must not reuse it).
+_LOOP_MODELS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, GenerativeModel]]" = (
+    weakref.WeakKeyDictionary()
+)
 
-    safety_settings = {
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-    }
-    
-    if response_schema == None:
-        generation_config = GenerationConfig(
+
+def _get_model(model_name: str = _DEFAULT_MODEL) -> GenerativeModel:
+    """Return a shared GenerativeModel; built after Vertex AI init on first use."""
+    model = _MODEL_CACHE.get(model_name)
+    if model is None:
+        model = _MODEL_CACHE.setdefault(model_name, GenerativeModel(model_name))
+    return model
+
+
+def _get_loop_model(model_name: str = _DEFAULT_MODEL) -> GenerativeModel:
+    """Return the GenerativeModel for async calls on the running event loop."""
+    models = _LOOP_MODELS.setdefault(asyncio.get_running_loop(), {})
+    model = models.get(model_name)
+    if model is None:
+        model = models.setdefault(model_name, GenerativeModel(model_name))
+    return model
+
+
+@functools.lru_cache(maxsize=32)
+def _make_gen_cfg(schema_key: str | None) -> GenerationConfig:
+    # schema_key is the schema's canonical JSON dump, so equal schemas share one config
+    if schema_key is None:
+        return GenerationConfig(
             max_output_tokens=65535,
             temperature=1.2,
             top_p=0.7,
             response_mime_type="application/json",
         )
-    else:
-        generation_config = GenerationConfig(
-            temperature=1.2,
-            top_p=0.7,
-            max_output_tokens=65535,  # Increase token limit
-            response_mime_type="application/json",
-            response_schema=response_schema
-        )
-        
+    return GenerationConfig(
+        temperature=1.2,
+        top_p=0.7,
+        max_output_tokens=65535,  # Increase token limit
+        response_mime_type="application/json",
+        response_schema=json.loads(schema_key),
+    )
+
+
+def _gen_cfg_for(response_schema) -> GenerationConfig:
+    key = None if response_schema is None else json.dumps(response_schema, sort_keys=True)
+    return _make_gen_cfg(key)
+
+
+# Max concurrent generate_async calls per event loop (override with GEMINI_CONCURRENCY)
+_GEN_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", "8"))
+_GEN_SEMAPHORES: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _gen_semaphore() -> asyncio.Semaphore:
+    # asyncio primitives are bound to one loop, so keep one semaphore per running loop
+    loop = asyncio.get_running_loop()
+    sem = _GEN_SEMAPHORES.get(loop)
+    if sem is None:
+        sem = _GEN_SEMAPHORES[loop] = asyncio.Semaphore(_GEN_CONCURRENCY)
+    return sem
+
+
+def _generation_request(parts, response_schema):
+    _ensure_vertexai_init()
     # Normalize parts: ensure strings are wrapped as text parts
     normalized_parts = [Part.from_text(p) if isinstance(p, str) else p for p in parts]
+    return normalized_parts, _gen_cfg_for(response_schema)
 
-    response = model.generate_content(
+
+def generate(parts, response_schema=None):
+    """Wrapper around model.generate_content with sane defaults.
+
+    - Coerces any plain-text parts into Part.from_text to avoid proto parsing issues.
+    - Leaves binary/URI parts as-is.
+    - Reuses the model and generation config across calls.
+    """
+    normalized_parts, generation_config = _generation_request(parts, response_schema)
+
+    response = _get_model().generate_content(
         normalized_parts,
         generation_config=generation_config,
-        safety_settings=safety_settings,
+        safety_settings=_SAFETY_SETTINGS,
         stream=False,
     )
     
     return response.text
 
 
+async def generate_async(parts, response_schema=None):
+    """Async counterpart of generate() for fanning out many scenes with asyncio.gather.
+
+    At most GEMINI_CONCURRENCY (default 8) requests are in flight per event loop.
+    """
+    normalized_parts, generation_config = _generation_request(parts, response_schema)
+    model = _get_loop_model()
+
+    async with _gen_semaphore():
+        response = await model.generate_content_async(
+            normalized_parts,
+            generation_config=generation_config,
+            safety_settings=_SAFETY_SETTINGS,
+        )
+
+    return response.text
+
+
+_DIARIZED_PROMPT: Final = """
+Analyze the provided video scene with meticulous attention to detail and extract the following metadata in a strict JSON format adhering to the specified schema. Your analysis should be comprehensive, accurate, and suitable for production use.
+
+**Video Scene Analysis and Diarized Transcript Extraction:**
+
+1.  **Diarized Transcript (`diarized_transcript`):**
+    * Generate a detailed diarized transcript of the video scene.
+    * For each speaker, identify:
+        * **Person:** If possible, identify the speaker by name. If not, use generic identifiers like "Speaker 1," "Speaker 2," etc.
+        * **Script:** Transcribe the speaker's spoken words verbatim.
+    * Structure the transcript as a JSON list, with each element being a dictionary containing the speaker's name or identifier and their spoken words.
+    * Example:
+    ```json
+    {{
+        "diarized_transcript": [
+            {{"Speaker 1": "I'm very excited about this project."}},
+            {{"Speaker 2": "However, there are some potential risks."}},
+            {{"Speaker 1": "I understand your concerns."}}
+        ]
+    }}
+    ```
+
+**Strict JSON Response Schema:**
+
+Your response must be a valid JSON object conforming to the following schema:
+"""
+_DIARIZED_SCHEMA: Final = {
+    "type": "object",
+    "properties": {
+    "diarized_transcript": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "Person": {"type":"string"},
+                "Script": {"type":"string"}
+            }
+        }
+    }
+    },
+    "required": [
+    "diarized_transcript"
+    ]
+}
+
+
+def _diarized_request(video_path: str):
+    # Upload local video to GCS and use URI for Gemini
+    bucket = _get_or_create_bucket(_resolve_project_id())
+    gs_uri = _upload_file_to_bucket(video_path, bucket, prefix=_input_prefix(os.environ.get("INPUT_FOLDER")))
+    video_part = Part.from_uri(uri=gs_uri, mime_type="video/mp4")
+
+    return [_DIARIZED_PROMPT, video_part], _DIARIZED_SCHEMA
+
+
+def _parse_diarized_response(response: str) -> str:
+    try:
+        metadata = json.loads(response)
+        return json.dumps(metadata, indent=2, ensure_ascii=False)
+
+    except json.JSONDecodeError:
+        return f"Error decoding JSON response: {response}"
+
+
 def extract_scene_metadata_diarized_transcript(video_path: str):
     """
     Extract diarized transcript metadata from a video scene.
@@ -193,65 +402,22 @@ def extract_scene_metadata_diarized_transcript(video_path: str):
     large inline blobs).
     """
     try:
-        # Upload local video to GCS and use URI for Gemini
-        bucket = _get_or_create_bucket(_resolve_project_id())
-        gs_uri = _upload_file_to_bucket(video_path, bucket)
-        video_part = Part.from_uri(uri=gs_uri, mime_type="video/mp4")
-
-        prompt = """
-        Analyze the provided video scene with meticulous attention to detail and extract the following metadata in a strict JSON format adhering to the specified schema. Your analysis should be comprehensive, accurate, and suitable for production use.
-
-        **Video Scene Analysis and Diarized Transcript Extraction:**
-
-        1.  **Diarized Transcript (`diarized_transcript`):**
-            * Generate a detailed diarized transcript of the video scene.
-            * For each speaker, identify:
-                * **Person:** If possible, identify the speaker by name. If not, use generic identifiers like "Speaker 1," "Speaker 2," etc.
-                * **Script:** Transcribe the speaker's spoken words verbatim.
-            * Structure the transcript as a JSON list, with each element being a dictionary containing the speaker's name or identifier and their spoken words.
-            * Example:
-            ```json
-            {{
-                "diarized_transcript": [
-                    {{"Speaker 1": "I'm very excited about this project."}},
-                    {{"Speaker 2": "However, there are some potential risks."}},
-                    {{"Speaker 1": "I understand your concerns."}}
-                ]
-            }}
-            ```
-
-        **Strict JSON Response Schema:**
-
-        Your response must be a valid JSON object conforming to the following schema:
-        """
-        response_schema = {
-            "type": "object",
-            "properties": {
-            "diarized_transcript": {
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "Person": {"type":"string"},
-                        "Script": {"type":"string"}
-                    }
-                }
-            }
-            },
-            "required": [
-            "diarized_transcript"
-            ]
-        }
-
-        response = generate([prompt, video_part], response_schema)
+        parts, response_schema = _diarized_request(video_path)
+        return _parse_diarized_response(generate(parts, response_schema))
+    except Exception as e:
+        return f"Error processing video: {e}"
 
-        try:
-            metadata = json.loads(response)
-            return json.dumps(metadata, indent=2, ensure_ascii=False)
 
-        except json.JSONDecodeError:
-            return f"Error decoding JSON response: {response}"
+async def extract_scene_metadata_diarized_transcript_async(video_path: str):
+    """
+    Async variant of extract_scene_metadata_diarized_transcript.
 
+    Fan out many scenes with: await asyncio.gather(*(extract_scene_metadata_diarized_transcript_async(v) for v in videos))
+    """
+    try:
+        # Upload runs in a thread so the event loop keeps serving other scenes
+        parts, response_schema = await asyncio.to_thread(_diarized_request, video_path)
+        return _parse_diarized_response(await generate_async(parts, response_schema))
     except Exception as e:
         return f"Error processing video: {e}"
 
@@ -259,6 +425,136 @@ def extract_scene_metadata_diarized_transcript(video_path: str):
 ########################################################
 # Guided diarized transcript using ASR tokens
 ########################################################
+def _normalize_text(s: str) -> str:
+    return _NORM_RE2.sub(" ", _NORM_RE1.sub(" ", s.lower())).strip()
+
+
+class _AsrWords(NamedTuple):
+    """ASR tokens as parallel arrays (struct-of-arrays), sorted chronologically."""
+    raws: list[str]
+    norms: list[str]
+    starts: array
+    ends: array
+
+
+def _flatten_words(trans) -> _AsrWords:
+    # Accept a dict or a path to JSON
+    import json as _json
+    from pathlib import Path as _Path
+    if isinstance(trans, str):
+        try:
+            trans = _json.loads(_Path(trans).read_text(encoding="utf-8"))
+        except Exception:
+            # If string but not a path or fails to load, assume it's already JSON text
+            trans = _json.loads(trans)
+    rows = [
+        (float(w.get("start_time", 0.0)), float(w.get("end_time", 0.0)), text, norm)
+        for entry in trans.get("transcriptions", [])
+        if entry.get("alternative") == 1
+        for w in entry.get("words", [])
+        for text in (str(w.get("word", "")),)
+        if (norm := _normalize_text(text))
+    ]
+    # Ensure chronological order
+    rows.sort(key=operator.itemgetter(0, 1))
+    starts, ends, raws, norms = zip(*rows) if rows else ((), (), (), ())
+    return _AsrWords(list(raws), list(norms), array("d", starts), array("d", ends))
+
+
+_GUIDED_PROMPT: Final = (
+    "You are given a video scene and an ASR word sequence from an automatic transcript. "
+    "Your job is to produce a diarized transcript with the best possible verbatim Script, "
+    "but anchor each utterance to a contiguous span in the ASR sequence using TokenStart/TokenEnd (inclusive). "
+    "Respect the chronological order: each subsequent utterance should occur later in the sequence than the previous one. "
+    "Choose the span that best covers the words in the Script (allowing minor ASR differences). "
+    "Do not invent indexes outside the provided range. If unsure, use -1 for both. "
+    "Return only valid JSON conforming to the schema."
+)
+
+_GUIDED_SCHEMA: Final = {
+    "type": "object",
+    "properties": {
+        "diarized_transcript": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "Person": {"type": "string"},
+                    "Script": {"type": "string"},
+                    "TokenStart": {"type": "integer", "minimum": -1},
+                    "TokenEnd": {"type": "integer", "minimum": -1}
+                },
+                "required": ["Person", "Script", "TokenStart", "TokenEnd"]
+            }
+        }
+    },
+    "required": ["diarized_transcript"]
+}
+
+
+def _guided_request(video_path: str, transcription, max_guidance_words: int):
+    # Upload video and build guidance
+    bucket = _get_or_create_bucket(_resolve_project_id())
+    gs_uri = _upload_file_to_bucket(video_path, bucket, prefix=_input_prefix(os.environ.get("INPUT_FOLDER")))
+    video_part = Part.from_uri(uri=gs_uri, mime_type="video/mp4")
+
+    asr_words = _flatten_words(transcription)
+    total = len(asr_words.norms)
+    limit = min(total, max_guidance_words)
+    # Build a compact guidance text with indexes and normalized tokens to constrain alignment
+    body = "\n".join(f"i={i}; w={w}" for i, w in enumerate(asr_words.norms[:limit]))
+    asr_guidance_text = _ASR_GUIDANCE_HEADER.format(limit=limit, total=total) + "\n" + body
+
+    return [_GUIDED_PROMPT, video_part, asr_guidance_text], _GUIDED_SCHEMA, asr_words, limit, total
+
+
+def _guided_results(response: str, asr_words: _AsrWords, limit: int, total: int) -> str:
+    # Parse and post-process into times
+    try:
+        obj = json.loads(response)
+    except json.JSONDecodeError as e:
+        tail = response[-400:] if isinstance(response, str) else ""
+        return (
+            f"Error decoding JSON response: {e}.\n"
+            f"Response (tail): {tail}"
+        )
+
+    diar = obj.get("diarized_transcript")
+    if not isinstance(diar, list):
+        return f"Error: Expected 'diarized_transcript' list, got {type(diar)}"
+
+    # Map token spans to start/end times; clamp and handle -1
+    results = []
+    for i, item in enumerate(diar):
+        if not isinstance(item, dict):
+            continue
+        person = str(item.get("Person", "")).strip() or "Unknown"
+        script = str(item.get("Script", "")).strip()
+        ts = item.get("TokenStart", -1)
+        te = item.get("TokenEnd", -1)
+
+        start_time = None
+        end_time = None
+        if isinstance(ts, int) and isinstance(te, int) and ts >= 0 and te >= ts:
+            ts_clamp = max(0, min(ts, limit - 1)) if limit > 0 else -1
+            te_clamp = max(0, min(te, limit - 1)) if limit > 0 else -1
+            if ts_clamp >= 0 and te_clamp >= ts_clamp and limit > 0:
+                start_time = asr_words.starts[ts_clamp] if ts_clamp < len(asr_words.starts) else None
+                end_time = asr_words.ends[te_clamp] if te_clamp < len(asr_words.ends) else None
+
+        results.append({
+            "Person": person,
+            "Script": script,
+            "TokenStart": ts if isinstance(ts, int) else -1,
+            "TokenEnd": te if isinstance(te, int) else -1,
+            "start_time": start_time,
+            "end_time": end_time,
+        })
+
+    final_obj = {"diarized_transcript": results, "asr_token_count_used": limit, "asr_token_count_total": total}
+    return json.dumps(final_obj, indent=2, ensure_ascii=False)
+
+
 def extract_scene_guided_diarized_transcript(
     video_path: str,
     transcription,
@@ -282,148 +578,108 @@ def extract_scene_guided_diarized_transcript(
           - start_time: float seconds (mapped from ASR based on TokenStart)
           - end_time: float seconds (mapped from ASR based on TokenEnd)
     """
+    try:
+        parts, response_schema, asr_words, limit, total = _guided_request(video_path, transcription, max_guidance_words)
+        return _guided_results(generate(parts, response_schema), asr_words, limit, total)
+    except Exception as e:
+        return f"Error processing video: {e}"
 
-    def _normalize_text(s: str) -> str:
-        import re as _re
-        s = s.lower()
-        s = _re.sub(r"[^a-z0-9\s]", " ", s)
-        s = _re.sub(r"\s+", " ", s).strip()
-        return s
-
-    def _flatten_words(trans):
-        # Accept a dict or a path to JSON
-        import json as _json
-        from pathlib import Path as _Path
-        if isinstance(trans, str):
-            try:
-                trans = _json.loads(_Path(trans).read_text(encoding="utf-8"))
-            except Exception:
-                # If string but not a path or fails to load, assume it's already JSON text
-                trans = _json.loads(trans)
-        words = []
-        for entry in trans.get("transcriptions", []):
-            if entry.get("alternative") != 1:
-                continue
-            for w in entry.get("words", []):
-                text = str(w.get("word", ""))
-                norm = _normalize_text(text)
-                if not norm:
-                    continue
-                words.append({
-                    "word": text,
-                    "norm": norm,
-                    "start": float(w.get("start_time", 0.0)),
-                    "end": float(w.get("end_time", 0.0)),
-                })
-        # Ensure chronological order
-        words.sort(key=lambda x: (x["start"], x["end"]))
-        return words
 
+async def extract_scene_guided_diarized_transcript_async(
+    video_path: str,
+    transcription,
+    max_guidance_words: int = 8000,
+):
+    """
+    Async variant of extract_scene_guided_diarized_transcript; same inputs and output.
+    """
     try:
-        # Upload video and build guidance
-        bucket = _get_or_create_bucket(_resolve_project_id())
-        gs_uri = _upload_file_to_bucket(video_path, bucket)
-        video_part = Part.from_uri(uri=gs_uri, mime_type="video/mp4")
-
-        asr_words = _flatten_words(transcription)
-        total = len(asr_words)
-        limit = min(total, max_guidance_words)
-        # Build a compact guidance text with indexes and normalized tokens to constrain alignment
-        lines = [
-            "ASR_GUIDANCE: This is the canonical ASR word sequence. Use contiguous spans of these token indexes to anchor each utterance.",
-            "For each utterance, return TokenStart and TokenEnd as inclusive indexes into this sequence.",
-            "If you cannot confidently align, set both indexes to -1.",
-            f"Token count provided: {limit} of {total} (0-based indexes).",
-            "Format: i=INDEX; w=WORD",
-        ]
-        for i in range(limit):
-            lines.append(f"i={i}; w={asr_words[i]['norm']}")
-        asr_guidance_text = "\n".join(lines)
-
-        prompt = (
-            "You are given a video scene and an ASR word sequence from an automatic transcript. "
-            "Your job is to produce a diarized transcript with the best possible verbatim Script, "
-            "but anchor each utterance to a contiguous span in the ASR sequence using TokenStart/TokenEnd (inclusive). "
-            "Respect the chronological order: each subsequent utterance should occur later in the sequence than the previous one. "
-            "Choose the span that best covers the words in the Script (allowing minor ASR differences). "
-            "Do not invent indexes outside the provided range. If unsure, use -1 for both. "
-            "Return only valid JSON conforming to the schema."
+        parts, response_schema, asr_words, limit, total = await asyncio.to_thread(
+            _guided_request, video_path, transcription, max_guidance_words
         )
+        return _guided_results(await generate_async(parts, response_schema), asr_words, limit, total)
+    except Exception as e:
+        return f"Error processing video: {e}"
 
-        response_schema = {
-            "type": "object",
-            "properties": {
-                "diarized_transcript": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "Person": {"type": "string"},
-                            "Script": {"type": "string"},
-                            "TokenStart": {"type": "integer", "minimum": -1},
-                            "TokenEnd": {"type": "integer", "minimum": -1}
-                        },
-                        "required": ["Person", "Script", "TokenStart", "TokenEnd"]
-                    }
-                }
-            },
-            "required": ["diarized_transcript"]
-        }
+########################################################
+# Translate WebVTT subtitles to another language (e.g., Spanish)
+########################################################
+# Speaker labels kept verbatim when requested: WebVTT voice tags ('<v Bob>Hello') and
+# all-caps 'NAME: content' labels ('BOB: Hello', '- DR. SMITH: Hi'). Mixed-case text before a
+# colon ('Listen to me: we go', 'Note: ...') is ordinary dialogue and is translated whole.
+_SPEAKER_VOICE_RE = re.compile(r"^(\s*<v(?:\.[^\s>]+)*\s[^>]*>\s*)(\S.*)$")
+_SPEAKER_LABEL_RE = re.compile(r"^(\s*(?:-\s*)?([^\s:][^:]{0,40}):\s+)(\S.*)$")
 
-        response = generate([prompt, video_part, asr_guidance_text], response_schema)
 
-        # Parse and post-process into times
-        try:
-            obj = json.loads(response)
-        except json.JSONDecodeError as e:
-            tail = response[-400:] if isinstance(response, str) else ""
-            return (
-                f"Error decoding JSON response: {e}.\n"
-                f"Response (tail): {tail}"
-            )
+def _split_speaker_prefix(body: str) -> tuple[str, str]:
+    """Split a cue line into (speaker_prefix, text); the prefix is '' when there is no label."""
+    m = _SPEAKER_VOICE_RE.match(body)
+    if m:
+        return m.group(1), m.group(2)
+    m = _SPEAKER_LABEL_RE.match(body)
+    if m and m.group(2).isupper():
+        return m.group(1), m.group(3)
+    return "", body
 
-        diar = obj.get("diarized_transcript")
-        if not isinstance(diar, list):
-            return f"Error: Expected 'diarized_transcript' list, got {type(diar)}"
-
-        # Map token spans to start/end times; clamp and handle -1
-        results = []
-        for i, item in enumerate(diar):
-            if not isinstance(item, dict):
-                continue
-            person = str(item.get("Person", "")).strip() or "Unknown"
-            script = str(item.get("Script", "")).strip()
-            ts = item.get("TokenStart", -1)
-            te = item.get("TokenEnd", -1)
-
-            start_time = None
-            end_time = None
-            if isinstance(ts, int) and isinstance(te, int) and ts >= 0 and te >= ts:
-                ts_clamp = max(0, min(ts, limit - 1)) if limit > 0 else -1
-                te_clamp = max(0, min(te, limit - 1)) if limit > 0 else -1
-                if ts_clamp >= 0 and te_clamp >= ts_clamp and limit > 0:
-                    start_time = float(asr_words[ts_clamp]["start"]) if ts_clamp < len(asr_words) else None
-                    end_time = float(asr_words[te_clamp]["end"]) if te_clamp < len(asr_words) else None
-
-            results.append({
-                "Person": person,
-                "Script": script,
-                "TokenStart": ts if isinstance(ts, int) else -1,
-                "TokenEnd": te if isinstance(te, int) else -1,
-                "start_time": start_time,
-                "end_time": end_time,
-            })
-
-        final_obj = {"diarized_transcript": results, "asr_token_count_used": limit, "asr_token_count_total": total}
-        return json.dumps(final_obj, indent=2, ensure_ascii=False)
 
-    except Exception as e:
-        return f"Error processing video: {e}"
+@functools.lru_cache(maxsize=4)
+def _get_translator(model_name: str) -> GeminiTranslator:
+    return GeminiTranslator(model_name)
+
+
+def _vtt_cue_text_indexes(lines: list[str]) -> list[int]:
+    """Indexes of cue payload lines: everything after a timing line up to the next blank line.
+
+    Headers, cue identifiers, timing/settings lines, NOTE/STYLE/REGION blocks, and
+    blank lines are never returned, so they pass through untouched.
+    """
+    out = []
+    in_cue = False
+    for i, ln in enumerate(lines):
+        if not ln.strip():
+            in_cue = False
+        elif "-->" in ln:
+            in_cue = True
+        elif in_cue:
+            out.append(i)
+    return out
+
+
+class _VttCues(NamedTuple):
+    lines: list[str]
+    idxs: list[int]
+    prefixes: list[str]
+    payload: list[str]
+    endings: list[str]
+
+
+def _vtt_cues(vtt_path: str, keep_speaker_prefix: bool) -> _VttCues:
+    from pathlib import Path as _Path
+
+    lines = _Path(vtt_path).read_text(encoding="utf-8").splitlines(keepends=True)
+    idxs = _vtt_cue_text_indexes(lines)
+
+    prefixes = []
+    payload = []
+    endings = []
+    for i in idxs:
+        body = lines[i].rstrip("\r\n")
+        endings.append(lines[i][len(body):])
+        prefix, text = _split_speaker_prefix(body) if keep_speaker_prefix else ("", body)
+        prefixes.append(prefix)
+        payload.append(text)
+    return _VttCues(lines, idxs, prefixes, payload, endings)
+
+
+def _render_vtt(cues: _VttCues, translated: list[str]) -> str:
+    lines = cues.lines
+    for i, prefix, txt, ending in zip(cues.idxs, cues.prefixes, translated, cues.endings):
+        lines[i] = prefix + txt.replace("\n", " ") + ending
+
+    # Return raw text; caller may write to disk
+    return "".join(lines)
 
 
-########################################################
-# Translate WebVTT subtitles to another language (e.g., Spanish)
-########################################################
 def translate_webvtt_to_language(
     vtt_path: str,
     target_language: str = "es",
@@ -437,9 +693,9 @@ def translate_webvtt_to_language(
     Args:
         vtt_path: Path to the .vtt file to translate.
         target_language: BCP-47 language code (e.g., 'es', 'es-ES').
-        keep_speaker_prefix: If a line contains a speaker prefix like 'Name: text',
-                                keep the prefix before the first colon unchanged and
-                                translate only the text after the colon.
+        keep_speaker_prefix: If a line starts with a speaker label, either a WebVTT
+                                voice tag ('<v Name>text') or an all-caps 'NAME: text',
+                                keep the label unchanged and translate only the text.
         model_name: Vertex AI model to use.
 
     Returns:
@@ -447,52 +703,32 @@ def translate_webvtt_to_language(
 
     Notes:
         - This function returns text/plain VTT, not JSON.
-        - Timecodes and cue ordering are preserved.
-        - Only subtitle text is translated.
+        - The file is parsed locally; only cue text lines are sent to the model
+          (via GeminiTranslator), so timecodes, settings, and cue ordering are
+          preserved by construction.
+        - Inside a running event loop (Jupyter, async services) use
+          translate_webvtt_to_language_async instead.
     """
-    from vertexai.generative_models import GenerativeModel, GenerationConfig, HarmCategory, HarmBlockThreshold
-    from pathlib import Path as _Path
-
-    original_vtt = _Path(vtt_path).read_text(encoding="utf-8")
-
-    # Clear, constrained prompt to preserve structure.
-    rules = f"""
-You are given a WebVTT subtitle file. Translate ONLY the spoken subtitle text to {target_language}.
-
-Strict rules:
-- Preserve the exact WebVTT structure:
-    - Keep the 'WEBVTT' header line if present.
-    - Preserve cue numbers (indexes), timestamps, settings (e.g., position, align), notes, and empty lines.
-    - Do not change timestamps or add/remove cues.
-- If a text line contains a speaker prefix in the form 'PREFIX: content':
-    - {'Keep PREFIX unchanged and translate only content.' if keep_speaker_prefix else 'Translate the entire line, including PREFIX.'}
-- Preserve any simple inline markup or formatting; translate the text content only.
-- Return ONLY the fully-formed .vtt text; no explanations, no JSON, no additional commentary.
-"""
+    cues = _vtt_cues(vtt_path, keep_speaker_prefix)
+    _ensure_vertexai_init()
+    return _render_vtt(cues, _get_translator(model_name).translate_lines(cues.payload, target_language))
 
-    model = GenerativeModel(model_name)
-    safety_settings = {
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-    }
-    gen_cfg = GenerationConfig(
-        temperature=0.2,  # low temperature to preserve structure
-        top_p=0.3,
-        max_output_tokens=65535,
-        response_mime_type="text/plain",
-    )
 
-    response = model.generate_content(
-        [rules, original_vtt],
-        generation_config=gen_cfg,
-        safety_settings=safety_settings,
-        stream=False,
-    )
+async def translate_webvtt_to_language_async(
+    vtt_path: str,
+    target_language: str = "es",
+    keep_speaker_prefix: bool = True,
+    model_name: str = "gemini-2.5-flash",
+) -> str:
+    """
+    Async variant of translate_webvtt_to_language, for callers already inside an event loop.
 
-    # Return raw text; caller may write to disk
-    return response.text
+    In a notebook: vtt_text = await translate_webvtt_to_language_async("episode.vtt", "fr")
+    """
+    cues = _vtt_cues(vtt_path, keep_speaker_prefix)
+    _ensure_vertexai_init()
+    translated = await _get_translator(model_name).translate_lines_async(cues.payload, target_language)
+    return _render_vtt(cues, translated)
 
 
 def translate_vtt_file_to_spanish(vtt_path: str, out_path: str | None = None) -> str:
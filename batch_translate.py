@@ -1,19 +1,23 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Iterable, List
+from typing import Iterable, List, Tuple
 
 from dotenv import load_dotenv
 
-from ttml_translate import translate_ttml, write_ttml
-from utils.gcs_utils import ensure_bucket, upload_file, resolve_project_id, expand_env
+from ttml_translate import expand_lines, parse_ttml, render_translations, unique_lines, write_ttml
+from utils.gcs_utils import ensure_bucket, list_object_names, upload_many, resolve_project_id, expand_env
+from engines import gemini_engine, translate_llm_engine
 from engines.gemini_engine import GeminiTranslator
 from engines.translate_llm_engine import CloudTranslateEngine
 
 
 DEFAULT_LANGS = "en,de,fr-fr,pt-br,es-419,es-es,tr"
+UPLOAD_WORKERS = 16
 
 
 def parse_args() -> argparse.Namespace:
@@ -47,6 +51,26 @@ def parse_args() -> argparse.Namespace:
         default="*.ttml",
         help="Glob pattern to match files (default: *.ttml)",
     )
+    p.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help=(
+            "Number of worker processes translating files in parallel (default: CPU count, capped at "
+            "the number of pending files). GEMINI_CONCURRENCY/TRANSLATE_CONCURRENCY is the total "
+            "in-flight request budget and is split evenly across workers"
+        ),
+    )
+    p.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate outputs even if they already exist in the GCS output folder",
+    )
+    p.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Store uploaded outputs gzip-compressed (Content-Encoding: gzip)",
+    )
     return p.parse_args()
 
 
@@ -61,6 +85,52 @@ def iter_files(root: Path, pattern: str, recursive: bool) -> Iterable[Path]:
         yield from root.glob(pattern)
 
 
+def out_name_for(in_stem: str, lang: str, engine_label: str) -> str:
+    return f"{in_stem}_{lang}_{engine_label}.ttml"
+
+
+# Per-process engine and event loop, created once by the pool initializer
+_ENGINE = None
+_LOOP = None
+
+
+def _init_worker(engine_name: str, max_concurrency: int) -> None:
+    global _ENGINE, _LOOP
+    if engine_name == "gemini":
+        _ENGINE = GeminiTranslator(max_concurrency=max_concurrency)
+    else:
+        _ENGINE = CloudTranslateEngine(max_concurrency=max_concurrency)
+    # The engines' async channels are bound to the loop that opens them, so each worker keeps
+    # one loop for its lifetime. Warming up on it fetches the auth token and opens the channel
+    # while the pool spins up, and every file then reuses that channel.
+    _LOOP = asyncio.new_event_loop()
+    _LOOP.run_until_complete(_ENGINE.warmup_async())
+
+
+def _process_file(path_str: str, langs: List[str], engine_label: str, out_dir: str) -> List[Tuple[str, int]]:
+    """Translate one TTML into every language and write the outputs (runs in a worker process).
+
+    The file is parsed once and translated into all languages with a single
+    translate_lines_multi_async call on the worker's loop. Returns
+    (out_name, line_count) per written file.
+    """
+    path = Path(path_str)
+    tree, line_nodes, texts = parse_ttml(path_str)
+    # Duplicates and empty/punctuation-only lines are collapsed before the API call
+    keys, index = unique_lines(texts)
+    if keys:
+        by_key = _LOOP.run_until_complete(_ENGINE.translate_lines_multi_async(keys, langs))
+    else:
+        by_key = {lang: [] for lang in langs}
+    translations = {lang: expand_lines(texts, index, arr) for lang, arr in by_key.items()}
+    written: List[Tuple[str, int]] = []
+    for lang, tree, line_count in render_translations(tree, line_nodes, texts, translations):
+        out_name = out_name_for(path.stem, lang, engine_label)
+        write_ttml(tree, str(Path(out_dir) / out_name))
+        written.append((out_name, line_count))
+    return written
+
+
 def main() -> None:
     # Load env and enforce project id for all downstream clients
     load_dotenv()
@@ -71,6 +141,10 @@ def main() -> None:
     os.environ["GCLOUD_PROJECT"] = project_id
     os.environ["CLOUDSDK_CORE_PROJECT"] = project_id
     os.environ["GOOGLE_CLOUD_QUOTA_PROJECT"] = project_id
+    # Snapshot the remaining settings once; helpers receive them explicitly
+    env_bucket = os.environ.get("BUCKET_NAME")
+    env_output = os.environ.get("OUTPUT_FOLDER", "output")
+    env_region = os.environ.get("GCP_REGION")
 
     args = parse_args()
     src_dir = Path(args.dir)
@@ -81,52 +155,83 @@ def main() -> None:
     if not langs:
         raise SystemExit("No target languages provided")
 
-    # Prepare engine and output dirs
+    # Engines are created inside each worker process
     engine_label = "gemini" if args.engine == "gemini" else "translateLLM"
-    if args.engine == "gemini":
-        engine = GeminiTranslator()
-
-        def translate_fn(lines, lang):
-            return engine.translate_lines(lines, lang)
-
-    else:
-        engine = CloudTranslateEngine()
-
-        def translate_fn(lines, lang):
-            return engine.translate_lines(lines, lang)
 
     local_out_root = Path(f"translated_outputs_{engine_label}")
     local_out_root.mkdir(parents=True, exist_ok=True)
 
     # GCS bucket/prefix
-    bucket_name = expand_env(os.environ.get("BUCKET_NAME")) or os.environ.get("BUCKET_NAME")
+    bucket_name = expand_env(env_bucket) or env_bucket
     if not bucket_name:
         raise SystemExit("BUCKET_NAME must be set in .env or environment")
-    output_prefix = os.environ.get("OUTPUT_FOLDER", "output").strip("/")
-    gcs_bucket = ensure_bucket(bucket_name, location=os.environ.get("GCP_REGION"), project_id=project_id)
-
-    count_files = 0
-    for path in iter_files(src_dir, args.pattern, args.recursive):
-        if not path.is_file():
-            continue
-        in_stem = path.stem
-        # Translate once per target lang
-        for lang in langs:
-            try:
-                tree, line_count = translate_ttml(str(path), translate_fn, lang)
-                out_name = f"{in_stem}_{lang}_{engine_label}.ttml"
-                out_path = local_out_root / out_name
-                write_ttml(tree, str(out_path))
-                gcs_uri = upload_file(str(out_path), gcs_bucket, object_name=out_name, prefix=output_prefix)
-                print(f"[{engine_label}] {path.name} -> {out_path.name} ({line_count} lines) | {gcs_uri}")
-            except Exception as e:
-                print(f"[ERROR] Failed {path.name} lang={lang}: {e}")
-        count_files += 1
-
+    output_prefix = env_output.strip("/")
+    gcs_bucket = ensure_bucket(bucket_name, location=env_region, project_id=project_id)
+
+    paths = [path for path in iter_files(src_dir, args.pattern, args.recursive) if path.is_file()]
+
+    # Resume support: one listing up front instead of an existence check per (file, lang)
+    existing = set() if args.force else list_object_names(gcs_bucket, output_prefix)
+    blob_prefix = f"{output_prefix}/" if output_prefix else ""
+    pending: List[Tuple[Path, List[str]]] = []
+    for path in paths:
+        todo = [lang for lang in langs if blob_prefix + out_name_for(path.stem, lang, engine_label) not in existing]
+        skipped = len(langs) - len(todo)
+        if skipped:
+            print(f"[skip] {path.name}: {skipped} output(s) already in gs://{bucket_name}/{blob_prefix}")
+        if todo:
+            pending.append((path, todo))
+
+    written: List[Tuple[str, str, int]] = []
+    failures = 0
+    if pending:
+        # Every worker starts up front and sends a warmup request, so never start more than
+        # there are files. Each worker has its own semaphore; split the request budget so the
+        # total in flight stays within the configured concurrency.
+        n_workers = max(1, min(args.workers, len(pending)))
+        budget = gemini_engine.MAX_CONCURRENCY if args.engine == "gemini" else translate_llm_engine.MAX_CONCURRENCY
+        per_worker = max(1, budget // n_workers)
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_worker, initargs=(args.engine, per_worker)
+        ) as ex:
+            futures = {
+                ex.submit(_process_file, str(path), todo, engine_label, str(local_out_root)): path
+                for path, todo in pending
+            }
+            # Results are logged here in the parent so worker output never interleaves
+            for fut in as_completed(futures):
+                path = futures[fut]
+                try:
+                    written.extend((path.name, out_name, line_count) for out_name, line_count in fut.result())
+                except Exception as e:
+                    print(f"[ERROR] Failed {path.name}: {e}")
+                    failures += 1
+
+    # Upload every output in one parallel batch once translation is done
+    uris = upload_many(
+        [out_name for _, out_name, _ in written],
+        gcs_bucket,
+        source_directory=str(local_out_root),
+        prefix=output_prefix,
+        max_workers=UPLOAD_WORKERS,
+        gzip_encoding=args.gzip,
+    )
+    for (src_name, out_name, line_count), uri in zip(written, uris):
+        if isinstance(uri, Exception):
+            print(f"[ERROR] Upload failed {out_name}: {uri}")
+            failures += 1
+        else:
+            print(f"[{engine_label}] {src_name} -> {out_name} ({line_count} lines) | {uri}")
+
+    count_files = len(paths)
     if count_files == 0:
         print("No files matched. Check --pattern or the directory contents.")
     else:
         print(f"\nDone. Processed {count_files} file(s) from: {src_dir}")
+    if failures:
+        # Every failure was logged above; exit non-zero so scripts and CI notice missing outputs
+        print(f"[ERROR] {failures} file(s) or upload(s) failed")
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
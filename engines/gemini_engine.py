@@ -1,22 +1,120 @@
 from __future__ import annotations
 
-import json
+import asyncio
 import os
-from typing import List, Optional
+import weakref
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
+import ijson
+import orjson
 import vertexai
 from vertexai.generative_models import GenerativeModel, GenerationConfig, HarmCategory, HarmBlockThreshold
 from dotenv import load_dotenv
 
+from utils.event_loop import run_sync
+from utils.translation_cache import DEFAULT_CACHE_PATH, TranslationCache
+
 
 load_dotenv()
 
+# Upper bound on in-flight Gemini requests per event loop; size it to the project's Vertex QPM tier.
+MAX_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", "8"))
+
+# Request sizing: ~12k source chars keeps the JSON response (~4 chars/token plus
+# expansion and quoting) well inside max_output_tokens, so calls rarely truncate
+# into the divide-and-conquer path.
+CHUNK_MAX_CHARS = 12000
+CHUNK_MAX_LINES = 80
+
+
+# Shared model handles keyed by event loop, then (project, location, model_name), so every
+# translator on a loop reuses one channel and token refresh. The async gRPC client is bound
+# to the loop that created it; sync wrappers run on a long-lived per-thread loop (run_sync)
+# so their handles are reused across calls too.
+_LOOP_MODELS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[Optional[str], str, str], GenerativeModel]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_loop_model(key: Tuple[Optional[str], str, str]) -> GenerativeModel:
+    models = _LOOP_MODELS.setdefault(asyncio.get_running_loop(), {})
+    model = models.get(key)
+    if model is None:
+        model = models.setdefault(key, GenerativeModel(key[2]))
+    return model
+
+
+def _chunks(lines: List[str], max_chars: int = CHUNK_MAX_CHARS, max_count: int = CHUNK_MAX_LINES) -> Iterator[List[str]]:
+    buf: List[str] = []
+    n = 0
+    for ln in lines:
+        if buf and (n + len(ln) > max_chars or len(buf) >= max_count):
+            yield buf
+            buf = []
+            n = 0
+        buf.append(ln)
+        n += len(ln)
+    if buf:
+        yield buf
+
+
+class _LineCounter:
+    """Tracks how many output lines a streamed newline-delimited response has so far."""
+
+    def __init__(self) -> None:
+        self._started = False
+        self._newlines = 0  # newlines between the first and last non-newline characters
+        self._trailing = 0  # newlines after the last non-newline character so far
+
+    def feed(self, piece: str) -> int:
+        # Same count as _parse_text_chunk's strip("\n").split("\n"), kept incrementally so each
+        # piece costs O(len(piece)) rather than a re-scan of everything received.
+        if not self._started:
+            piece = piece.lstrip("\n")
+            if not piece:
+                return 0
+            self._started = True
+        body = piece.rstrip("\n")
+        if body:
+            self._newlines += self._trailing + body.count("\n")
+            self._trailing = len(piece) - len(body)
+        else:
+            self._trailing += len(piece)
+        return self._newlines + 1
+
+
+class _JsonItemCounter:
+    """Counts top-level array items of a streamed JSON response with ijson's C backend."""
+
+    def __init__(self) -> None:
+        self._items = ijson.sendable_list()
+        self._coro = ijson.items_coro(self._items, "item")
+        self._count = 0
+
+    def feed(self, piece: str) -> int:
+        # Malformed JSON raises here, which aborts the stream like an overshoot would.
+        self._coro.send(piece.encode("utf-8"))
+        self._count += len(self._items)
+        del self._items[:]
+        return self._count
+
 
 class GeminiTranslator:
     """Translate lists of short lines using Gemini with strong structure guarantees."""
 
-    def __init__(self, model_name: str = "gemini-2.5-flash") -> None:
+    def __init__(
+        self,
+        model_name: str = "gemini-2.5-flash",
+        cache_path: Optional[str] = None,
+        json_output: bool = False,
+        max_concurrency: Optional[int] = None,
+    ) -> None:
         self.model_name = model_name
+        # In-flight request bound per event loop; defaults to MAX_CONCURRENCY
+        self.max_concurrency = max_concurrency or MAX_CONCURRENCY
+        # Chunks are exchanged as newline-delimited text (fewer output tokens than a JSON
+        # array); json_output=True always uses the JSON array contract instead.
+        self.json_output = json_output
         # Init Vertex AI once
         project = (
             os.environ.get("PROJECT_ID")
@@ -31,21 +129,132 @@ class GeminiTranslator:
                 # Allow lazy init if env is not fully configured at import time
                 pass
 
-        self.model = GenerativeModel(self.model_name)
+        self._model_key = (project, location, self.model_name)
         self.safety = {
             HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
             HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
             HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
             HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
         }
+        # asyncio primitives are bound to one loop, so keep one semaphore per driving loop
+        self._sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        # Generation configs are identical for every request of a kind, so build them once per instance
+        # instead of per chunk, split half, or fallback line.
+        self._json_cfg = GenerationConfig(
+            temperature=0.25,
+            top_p=0.4,
+            max_output_tokens=8192,
+            response_mime_type="application/json",
+            response_schema={"type": "array", "items": {"type": "string"}},
+        )
+        self._text_cfg = GenerationConfig(
+            temperature=0.25,
+            top_p=0.4,
+            max_output_tokens=8192,
+            response_mime_type="text/plain",
+        )
+        self._fallback_cfg = GenerationConfig(
+            temperature=0.2,
+            top_p=0.4,
+            max_output_tokens=1024,
+            response_mime_type="text/plain",
+        )
+        # Multi-language configs depend on the language set; keyed by the ordered tuple of codes.
+        self._multi_cfgs: Dict[Tuple[str, ...], GenerationConfig] = {}
+        # Persistent line cache shared across runs (override with GEMINI_CACHE_PATH)
+        self.cache = TranslationCache(cache_path or os.environ.get("GEMINI_CACHE_PATH") or DEFAULT_CACHE_PATH)
 
-    def translate_lines(self, lines: List[str], target_language: str) -> List[str]:
-        if not lines:
-            return []
+    def _sem(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        sem = self._sems.get(loop)
+        if sem is None:
+            sem = self._sems[loop] = asyncio.Semaphore(self.max_concurrency)
+        return sem
 
-        # Single-call, whole-script translation for maximum context preservation.
-        # Uses divide-and-conquer fallback if the response shape is invalid or request is too large.
+    async def _generate(self, contents: list, gen_cfg: GenerationConfig) -> Optional[str]:
+        # Only the request itself holds a semaphore slot, so recursive splits cannot deadlock.
+        model = _get_loop_model(self._model_key)
+        async with self._sem():
+            resp = await model.generate_content_async(contents, generation_config=gen_cfg, safety_settings=self.safety)
+        return resp.text
+
+    def warmup(self) -> None:
+        """Prime auth and the Vertex connection; sync wrapper over warmup_async."""
+        run_sync(self.warmup_async())
+
+    async def warmup_async(self) -> None:
+        """Send one tiny request so the first real batch skips token fetch and channel setup.
+
+        Run it on the loop that will do the translating: the async channel is per loop.
+        Failures are ignored; real requests surface them.
+        """
+        prompt, gen_cfg = self._fallback_request(".", "en")
+        try:
+            await self._generate([prompt], gen_cfg)
+        except Exception:
+            pass
+
+    async def _generate_counted(
+        self, contents: list, gen_cfg: GenerationConfig, expected: int, as_text: bool
+    ) -> Optional[str]:
+        """Stream a chunk response, abandoning it once it holds more than expected entries.
+
+        Returns the full text, or None when generation was cut off early, so the
+        caller can split without paying for the rest of a drifting response.
+        """
+        model = _get_loop_model(self._model_key)
+        counter = _LineCounter() if as_text else _JsonItemCounter()
+        parts: List[str] = []
+        async with self._sem():
+            stream = await model.generate_content_async(
+                contents, generation_config=gen_cfg, safety_settings=self.safety, stream=True
+            )
+            try:
+                async for chunk in stream:
+                    try:
+                        piece = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. only finish metadata)
+                        continue
+                    parts.append(piece)
+                    if counter.feed(piece) > expected:
+                        return None
+            finally:
+                await stream.aclose()
+        return "".join(parts)
+
+    @staticmethod
+    def _expand(lines: List[str], uniq: List[str], uniq_out: List[str]) -> List[str]:
+        # Scatter translations of the unique lines back onto every original position.
+        pos = {s: i for i, s in enumerate(uniq)}
+        return [uniq_out[pos[ln]] for ln in lines]
+
+    def _from_cache(self, lines: List[str], target_language: str) -> Tuple[List[Optional[str]], List[int]]:
+        out = self.cache.get_many(self.model_name, target_language, lines)
+        return out, [i for i, hit in enumerate(out) if hit is None]
+
+    def _fill_from_fresh(
+        self,
+        out: List[Optional[str]],
+        lines: List[str],
+        indices: List[int],
+        fresh: List[Optional[str]],
+        target_language: str,
+    ) -> None:
+        # None marks a line whose every request failed: it passes through untranslated and
+        # is not cached, so the next run retries it. Real results are cached even when they
+        # equal the source (names, "OK.", same-language targets).
+        for i, txt in zip(indices, fresh):
+            out[i] = lines[i] if txt is None else txt
+        self.cache.set_many(
+            self.model_name,
+            target_language,
+            ((lines[i], txt) for i, txt in zip(indices, fresh) if txt),
+        )
 
+    def _chunk_request(self, target_language: str) -> Tuple[str, GenerationConfig]:
         # Prompt ensures one-to-one mapping, natural phrasing, and minimal expansion for reading speed.
         rules = (
             "You are a professional subtitle translator. Translate each input line to "
@@ -55,64 +264,215 @@ class GeminiTranslator:
             "Preserve speaker intent, tone, and register. Keep punctuation natural.\n"
             "Keep length close to source for reading speed (aim within ±15% characters per line when possible)."
         )
+        return rules, self._json_cfg
 
-        response_schema = {
-            "type": "array",
-            "items": {"type": "string"},
-        }
-
-        gen_cfg = GenerationConfig(
-            temperature=0.25,
-            top_p=0.4,
-            max_output_tokens=8192,
-            response_mime_type="application/json",
-            response_schema=response_schema,
+    def _text_chunk_request(self, target_language: str) -> Tuple[str, GenerationConfig]:
+        # Same contract as _chunk_request without JSON quoting/escaping in the output.
+        rules = (
+            "You are a professional subtitle translator. Translate each input line to "
+            f"{target_language} using the most natural phrasing for TV/film dialogue.\n\n"
+            "Output exactly as many lines as the input, each the translation of the input line "
+            "at the same position. No numbering, no JSON, no extra text.\n"
+            "Do not add or remove lines, do not merge or split.\n"
+            "Preserve speaker intent, tone, and register. Keep punctuation natural.\n"
+            "Keep length close to source for reading speed (aim within ±15% characters per line when possible)."
         )
+        return rules, self._text_cfg
 
-        def translate_chunk(chunk: List[str]) -> List[str]:
+    @staticmethod
+    def _text_payload(chunk: List[str]) -> Optional[str]:
+        # Lines must map 1:1 onto output lines; embedded newlines or blank lines need JSON.
+        if any("\n" in ln or not ln.strip() for ln in chunk):
+            return None
+        return f"Input ({len(chunk)} lines):\n" + "\n".join(chunk)
+
+    @staticmethod
+    def _parse_text_chunk(text: Optional[str], expected: int) -> Optional[List[str]]:
+        out = (text or "").strip("\n").split("\n")
+        if len(out) == expected:
+            return [ln.rstrip("\r") for ln in out]
+        return None
+
+    @staticmethod
+    def _parse_chunk(text: Optional[str], expected: int) -> Optional[List[str]]:
+        # None signals a shape violation so the caller can split and retry.
+        arr = orjson.loads(text or "[]")
+        if isinstance(arr, list) and len(arr) == expected:
+            return [str(x) if x is not None else "" for x in arr]
+        return None
+
+    def translate_lines(self, lines: List[str], target_language: str) -> List[str]:
+        """Translate lines into one language; sync wrapper over translate_lines_async."""
+        return run_sync(self.translate_lines_async(lines, target_language))
+
+    async def translate_lines_async(self, lines: List[str], target_language: str) -> List[str]:
+        """Async counterpart of translate_lines using the non-blocking Vertex AI client.
+
+        Lets callers overlap many (file, language) requests on one event loop
+        instead of blocking a thread per HTTPS round-trip.
+        """
+        if not lines:
+            return []
+        uniq = list(dict.fromkeys(lines))
+        out, missing = self._from_cache(uniq, target_language)
+        if missing:
+            fresh = await self._translate_lines_async([uniq[i] for i in missing], target_language)
+            self._fill_from_fresh(out, uniq, missing, fresh, target_language)
+        return self._expand(lines, uniq, out)
+
+    async def _translate_lines_async(self, lines: List[str], target_language: str) -> List[Optional[str]]:
+        # Lines are sent in budget-sized chunks (see CHUNK_MAX_CHARS) for context with bounded output.
+        # Uses divide-and-conquer fallback if the response shape is invalid or request is too large;
+        # chunks and split halves are all in flight at once, bounded by MAX_CONCURRENCY.
+        rules, gen_cfg = self._chunk_request(target_language)
+        text_rules, text_cfg = self._text_chunk_request(target_language)
+        # Each line is JSON-encoded once per call; split halves re-join the cached fragments
+        # instead of re-serializing the same strings at every recursion level.
+        encoded: Dict[str, str] = {}
+
+        def json_payload(chunk: List[str]) -> str:
+            for ln in chunk:
+                if ln not in encoded:
+                    encoded[ln] = orjson.dumps(ln).decode()
+            return "[" + ",".join([encoded[ln] for ln in chunk]) + "]"
+
+        async def translate_chunk(chunk: List[str]) -> List[Optional[str]]:
             # Try one request for this chunk.
             try:
-                resp = self.model.generate_content(
-                    [rules, json.dumps(chunk, ensure_ascii=False)],
-                    generation_config=gen_cfg,
-                    safety_settings=self.safety,
-                    stream=False,
-                )
-                text = resp.text or "[]"
-                arr = json.loads(text)
-                if isinstance(arr, list) and len(arr) == len(chunk):
-                    return [str(x) if x is not None else "" for x in arr]
+                payload = None if self.json_output else self._text_payload(chunk)
+                if payload is not None:
+                    text = await self._generate_counted([text_rules, payload], text_cfg, len(chunk), as_text=True)
+                    arr = self._parse_text_chunk(text, len(chunk)) if text is not None else None
+                else:
+                    contents = [rules, json_payload(chunk)]
+                    text = await self._generate_counted(contents, gen_cfg, len(chunk), as_text=False)
+                    arr = self._parse_chunk(text, len(chunk)) if text is not None else None
+                if arr is not None:
+                    return arr
             except Exception:
                 pass
 
             # If we reach here, try to split the chunk to reduce size or recover from drift.
             if len(chunk) == 1:
                 # Last resort, per-line fallback
-                return self._fallback_per_line(chunk, target_language)
+                return [await self._fallback_line_async(chunk[0], target_language)]
             mid = len(chunk) // 2
-            left = translate_chunk(chunk[:mid])
-            right = translate_chunk(chunk[mid:])
+            left, right = await asyncio.gather(translate_chunk(chunk[:mid]), translate_chunk(chunk[mid:]))
             return left + right
 
-        return translate_chunk(lines)
+        parts = await asyncio.gather(*(translate_chunk(chunk) for chunk in _chunks(lines)))
+        return [txt for part in parts for txt in part]
 
-    def _fallback_per_line(self, lines: List[str], target_language: str) -> List[str]:
-        gen_cfg = GenerationConfig(
-            temperature=0.2,
-            top_p=0.4,
-            max_output_tokens=1024,
-            response_mime_type="text/plain",
+    def _multi_request(self, target_languages: Sequence[str]) -> Tuple[str, GenerationConfig]:
+        langs = list(target_languages)
+        rules = (
+            "You are a professional subtitle translator. Translate each input line to every one of these "
+            f"target languages: {', '.join(langs)}. Use the most natural phrasing for TV/film dialogue.\n\n"
+            "Return ONLY a JSON object mapping each target language code to a JSON array of strings, "
+            "exactly the same length and order as the input array.\n"
+            "Do not add or remove lines, do not merge or split.\n"
+            "Preserve speaker intent, tone, and register. Keep punctuation natural.\n"
+            "Keep length close to source for reading speed (aim within ±15% characters per line when possible)."
         )
-        out: List[str] = []
-        for ln in lines:
-            prompt = (
-                "Translate the following subtitle line to "
-                f"{target_language}. Return only the translation.\n\n"
-                f"Line: {ln}"
+
+        key = tuple(langs)
+        gen_cfg = self._multi_cfgs.get(key)
+        if gen_cfg is None:
+            response_schema = {
+                "type": "object",
+                "properties": {lang: {"type": "array", "items": {"type": "string"}} for lang in langs},
+                "required": langs,
+            }
+            gen_cfg = self._multi_cfgs[key] = GenerationConfig(
+                temperature=0.25,
+                top_p=0.4,
+                # One response carries every language, so allow the model's full output budget.
+                max_output_tokens=65535,
+                response_mime_type="application/json",
+                response_schema=response_schema,
             )
-            try:
-                resp = self.model.generate_content([prompt], generation_config=gen_cfg, safety_settings=self.safety)
-                out.append((resp.text or "").strip())
-            except Exception:
-                out.append(ln)
+        return rules, gen_cfg
+
+    def translate_lines_multi(self, lines: List[str], target_languages: Sequence[str]) -> Dict[str, List[str]]:
+        """Translate lines into several languages with one request; see translate_lines_multi_async."""
+        return run_sync(self.translate_lines_multi_async(lines, target_languages))
+
+    async def translate_lines_multi_async(
+        self, lines: List[str], target_languages: Sequence[str]
+    ) -> Dict[str, List[str]]:
+        """Translate lines into several languages with a single Gemini call.
+
+        The source lines are sent once and the model returns a JSON object keyed
+        by language code. Any language missing from the response or with the
+        wrong number of lines falls back to its own translate_lines_async call.
+        """
+        langs = list(dict.fromkeys(target_languages))
+        uniq = list(dict.fromkeys(lines))
+        out: Dict[str, List[Optional[str]]] = {}
+        missing_by_lang: Dict[str, List[int]] = {}
+        for lang in langs:
+            out[lang], missing_by_lang[lang] = self._from_cache(uniq, lang)
+
+        # Only languages with cache misses go to the model, and only for the lines they miss.
+        todo_langs = [lang for lang in langs if missing_by_lang[lang]]
+        need = sorted(set().union(*missing_by_lang.values()))
+        if need:
+            fresh = await self._translate_lines_multi_async([uniq[i] for i in need], todo_langs)
+            for lang in todo_langs:
+                self._fill_from_fresh(out[lang], uniq, need, fresh[lang], lang)
+        return {lang: self._expand(lines, uniq, out[lang]) for lang in langs}
+
+    async def _translate_lines_multi_async(
+        self, lines: List[str], langs: List[str]
+    ) -> Dict[str, List[Optional[str]]]:
+        if not lines:
+            return {lang: [] for lang in langs}
+        if len(langs) == 1:
+            return {langs[0]: await self._translate_lines_async(lines, langs[0])}
+
+        # The response repeats every line once per language, so shrink the source budget to match.
+        chunks = _chunks(lines, max_chars=max(1, CHUNK_MAX_CHARS // len(langs)))
+        request = self._multi_request(langs)
+        parts = await asyncio.gather(
+            *(self._translate_chunk_multi_async(chunk, langs, request) for chunk in chunks)
+        )
+        return {lang: [txt for part in parts for txt in part[lang]] for lang in langs}
+
+    async def _translate_chunk_multi_async(
+        self, chunk: List[str], langs: List[str], request: Tuple[str, GenerationConfig]
+    ) -> Dict[str, List[Optional[str]]]:
+        out: Dict[str, List[Optional[str]]] = {}
+        rules, gen_cfg = request
+        try:
+            text = await self._generate([rules, orjson.dumps(chunk).decode()], gen_cfg)
+            obj = orjson.loads(text or "{}")
+            if isinstance(obj, dict):
+                for lang in langs:
+                    arr = obj.get(lang)
+                    if isinstance(arr, list) and len(arr) == len(chunk):
+                        out[lang] = [str(x) if x is not None else "" for x in arr]
+        except Exception:
+            pass
+
+        # Schema violations degrade to the per-language path for the affected languages only.
+        retry = [lang for lang in langs if lang not in out]
+        for lang, arr in zip(retry, await asyncio.gather(*(self._translate_lines_async(chunk, lang) for lang in retry))):
+            out[lang] = arr
         return out
+
+    def _fallback_request(self, line: str, target_language: str) -> Tuple[str, GenerationConfig]:
+        prompt = (
+            "Translate the following subtitle line to "
+            f"{target_language}. Return only the translation.\n\n"
+            f"Line: {line}"
+        )
+        return prompt, self._fallback_cfg
+
+    async def _fallback_line_async(self, line: str, target_language: str) -> Optional[str]:
+        # Reached only for single-line chunks; the recursive split already runs lines concurrently.
+        prompt, gen_cfg = self._fallback_request(line, target_language)
+        try:
+            return (await self._generate([prompt], gen_cfg) or "").strip()
+        except Exception:
+            # Failed, not translated: the caller passes the source through uncached
+            return None
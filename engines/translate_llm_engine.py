@@ -1,34 +1,118 @@
 from __future__ import annotations
 
-from typing import List, Optional, Tuple
+import asyncio
+import functools
+import uuid
+import weakref
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from google.cloud import translate_v3 as translate
 from dotenv import load_dotenv
 import google.auth
 import os
 
+from utils.event_loop import run_sync
+from utils.gcs_utils import get_client as get_storage_client
+from utils.translation_cache import TRANSLATE_CACHE_PATH, TranslationCache
+
 
 load_dotenv()
 
+# Upper bound on in-flight translate_text requests per event loop (per-project QPS quota).
+MAX_CONCURRENCY = int(os.environ.get("TRANSLATE_CONCURRENCY", "8"))
+
+# Documents with at least this many lines (after cache hits) go through a batch_translate_text
+# job instead of inline requests. Batch jobs need a source language, a regional location, and
+# BUCKET_NAME for the GCS input/output files.
+BATCH_MIN_LINES = int(os.environ.get("TRANSLATE_BATCH_MIN_LINES", "2000"))
+BATCH_LOCATION = os.environ.get("GCP_REGION", "us-central1")
+BATCH_PREFIX = "translate-batch"
+BATCH_TIMEOUT = 1800
+
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Optional[str], translate.TranslationServiceAsyncClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _credentials(quota_proj: Optional[str]):
+    # Build credentials that explicitly use the PROJECT_ID as quota project
+    creds, _ = google.auth.default()
+    if quota_proj and hasattr(creds, "with_quota_project"):
+        try:
+            creds = creds.with_quota_project(quota_proj)
+        except Exception:
+            pass
+    return creds
+
+
+@functools.lru_cache(maxsize=None)
+def _get_client(quota_proj: Optional[str]) -> translate.TranslationServiceClient:
+    # One client (channel, credentials, token refresh) per quota project, shared by all engines.
+    return translate.TranslationServiceClient(credentials=_credentials(quota_proj))
+
+
+def _get_async_client(quota_proj: Optional[str]) -> translate.TranslationServiceAsyncClient:
+    # The async gRPC channel is bound to the loop that created it, so keep one per running loop;
+    # sync wrappers use run_sync's long-lived loop, so their client is reused across calls.
+    clients = _ASYNC_CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(quota_proj)
+    if client is None:
+        client = clients[quota_proj] = translate.TranslationServiceAsyncClient(credentials=_credentials(quota_proj))
+    return client
+
 
 class CloudTranslateEngine:
     """Translate batches of lines using Cloud Translation API v3."""
 
-    def __init__(self, location: str = "global") -> None:
+    def __init__(
+        self,
+        location: str = "global",
+        cache_path: Optional[str] = None,
+        source_language: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> None:
         self.location = location
-        # Build client with credentials that explicitly use the PROJECT_ID as quota project
-        creds, _ = google.auth.default()
-        quota_proj = (
+        # In-flight request bound per event loop; defaults to MAX_CONCURRENCY
+        self.max_concurrency = max_concurrency or MAX_CONCURRENCY
+        # Default source language for calls that don't pass one (env TRANSLATE_SOURCE_LANGUAGE)
+        self.source_language = source_language or os.environ.get("TRANSLATE_SOURCE_LANGUAGE")
+        self._quota_proj = (
             os.environ.get("PROJECT_ID")
             or os.environ.get("GOOGLE_CLOUD_PROJECT")
             or os.environ.get("GCLOUD_PROJECT")
         )
-        if quota_proj and hasattr(creds, "with_quota_project"):
-            try:
-                creds = creds.with_quota_project(quota_proj)
-            except Exception:
-                pass
-        self.client = translate.TranslationServiceClient(credentials=creds)
+        self.client = _get_client(self._quota_proj)
+        self._sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        # Persistent line cache shared across runs (override with TRANSLATE_CACHE_PATH)
+        self.cache = TranslationCache(cache_path or os.environ.get("TRANSLATE_CACHE_PATH") or TRANSLATE_CACHE_PATH)
+
+    def _sem(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        sem = self._sems.get(loop)
+        if sem is None:
+            sem = self._sems[loop] = asyncio.Semaphore(self.max_concurrency)
+        return sem
+
+    def warmup(self) -> None:
+        """Prime auth and the Translation connection; sync wrapper over warmup_async."""
+        run_sync(self.warmup_async())
+
+    async def warmup_async(self) -> None:
+        """Send one tiny request so the first real batch skips token fetch and channel setup.
+
+        Run it on the loop that will do the translating: the async channel is per loop.
+        Failures are ignored; real requests surface them. Bypasses the line cache,
+        which would otherwise answer it without touching the network.
+        """
+        try:
+            await self._translate_lines_async(["."], "en")
+        except Exception:
+            pass
 
     def translate_lines(
         self,
@@ -37,8 +121,58 @@ class CloudTranslateEngine:
         source_language: Optional[str] = None,
         model: Optional[str] = None,
     ) -> List[str]:
+        """Translate lines into one language; sync wrapper over translate_lines_async."""
         if not lines:
             return []
+        return run_sync(
+            self.translate_lines_async(lines, target_language, source_language=source_language, model=model)
+        )
+
+    async def translate_lines_async(
+        self,
+        lines: List[str],
+        target_language: str,
+        source_language: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> List[str]:
+        """Translate lines with every chunk request in flight at once (bounded by MAX_CONCURRENCY).
+
+        Lines already in the persistent cache are not sent again.
+        """
+        if not lines:
+            return []
+        source_language = source_language or self.source_language
+        # Cache entries are scoped by model and source language as well as target language.
+        cache_model = f"translate-v3/{model or 'default'}/{source_language or 'auto'}"
+        out = self.cache.get_many(cache_model, target_language, lines)
+        missing = [i for i, hit in enumerate(out) if hit is None]
+        if missing:
+            fresh = await self._translate_lines_async(
+                [lines[i] for i in missing], target_language, source_language=source_language, model=model
+            )
+            for i, txt in zip(missing, fresh):
+                out[i] = txt
+            # Failed requests raise rather than pass through, so every result is the API's own;
+            # cache it even when it equals the source. Blank lines are skipped, never sent.
+            self.cache.set_many(
+                cache_model,
+                target_language,
+                ((lines[i], txt) for i, txt in zip(missing, fresh) if txt and lines[i].strip()),
+            )
+        return out
+
+    async def _translate_lines_async(
+        self,
+        lines: List[str],
+        target_language: str,
+        source_language: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> List[str]:
+        if source_language and len(lines) >= BATCH_MIN_LINES and _batchable(lines):
+            try:
+                return await asyncio.to_thread(self._batch_translate, lines, target_language, source_language, model)
+            except Exception as e:
+                print(f"[WARN] batch_translate_text failed, translating inline: {e}")
 
         project_id = (
             os.environ.get("PROJECT_ID")
@@ -49,17 +183,14 @@ class CloudTranslateEngine:
             raise ValueError("PROJECT_ID is not set. Configure environment or .env.")
 
         parent = f"projects/{project_id}/locations/{self.location}"
+        client = _get_async_client(self._quota_proj)
 
-        # Split into safe chunks to avoid request size limits
-        chunks = _chunk_by_chars(lines, max_chars=80000, max_items=256)
-        out: List[str] = []
-        for chunk in chunks:
+        async def translate_chunk(chunk: List[str]) -> List[str]:
             # Cloud Translation rejects empty contents; filter them but keep indices to rebuild order.
             non_empty_indices = [i for i, s in enumerate(chunk) if (s or "").strip() != ""]
             if not non_empty_indices:
                 # Entire chunk is empty/whitespace; pass through unchanged
-                out.extend([s for s in chunk])
-                continue
+                return list(chunk)
 
             filtered_contents = [chunk[i] for i in non_empty_indices]
 
@@ -74,28 +205,124 @@ class CloudTranslateEngine:
             if model:
                 request["model"] = model  # e.g., "general/base"
 
-            response = self.client.translate_text(request=request)
+            async with self._sem():
+                response = await client.translate_text(request=request)
             translations = [t.translated_text for t in response.translations]
             # Reconstruct full chunk with translated non-empty items and original empties
             rebuilt = list(chunk)
             for idx, translated_text in zip(non_empty_indices, translations):
                 rebuilt[idx] = translated_text
-            out.extend(rebuilt)
-        return out
+            return rebuilt
+
+        # Split into safe chunks to avoid request size limits; gather keeps chunk order
+        chunks = _chunk_by_chars(lines, max_chars=80000, max_items=256)
+        parts = await asyncio.gather(*(translate_chunk(chunk) for chunk in chunks))
+        return [txt for part in parts for txt in part]
+
+    def _batch_translate(
+        self,
+        lines: List[str],
+        target_language: str,
+        source_language: str,
+        model: Optional[str] = None,
+    ) -> List[str]:
+        """Translate lines with one batch_translate_text job; blocks until the job finishes.
+
+        Non-empty lines are written as a two-column TSV (index, text) under
+        gs://BUCKET_NAME/translate-batch/<job>/, and the job's TSV output is
+        read back by index. The job's objects are deleted afterwards.
+        """
+        project_id = self._quota_proj
+        bucket_name = os.path.expandvars(os.environ.get("BUCKET_NAME") or "")
+        if not project_id or not bucket_name:
+            raise ValueError("PROJECT_ID and BUCKET_NAME are required for batch translation.")
+        bucket = get_storage_client(project_id).bucket(bucket_name)
+        job = f"{BATCH_PREFIX}/{uuid.uuid4().hex}"
+        try:
+            body = "".join(f"{i}\t{ln}\n" for i, ln in enumerate(lines) if ln.strip())
+            bucket.blob(f"{job}/input.tsv").upload_from_string(body, content_type="text/tab-separated-values")
+
+            parent = f"projects/{project_id}/locations/{BATCH_LOCATION}"
+            request = {
+                "parent": parent,
+                "source_language_code": source_language,
+                "target_language_codes": [target_language],
+                "input_configs": [
+                    {"gcs_source": {"input_uri": f"gs://{bucket_name}/{job}/input.tsv"}, "mime_type": "text/plain"}
+                ],
+                "output_config": {"gcs_destination": {"output_uri_prefix": f"gs://{bucket_name}/{job}/out/"}},
+            }
+            if model:
+                request["models"] = {target_language: model}
+            self.client.batch_translate_text(request=request).result(timeout=BATCH_TIMEOUT)
+
+            # Output rows are (index, source, translation), in any order
+            out = list(lines)
+            seen = 0
+            suffix = f"_{target_language}_translations.tsv"
+            for blob in bucket.list_blobs(prefix=f"{job}/out/"):
+                if not blob.name.endswith(suffix):
+                    continue
+                # split("\n"), not splitlines(): translations may contain \r, \x85, \u2028, ...
+                for row in blob.download_as_text().split("\n"):
+                    cols = row.split("\t")
+                    if len(cols) >= 3:
+                        out[int(cols[0])] = cols[2]
+                        seen += 1
+            expected = body.count("\n")
+            if seen != expected:
+                raise ValueError(f"batch output has {seen} rows, expected {expected}")
+            return out
+        finally:
+            for blob in bucket.list_blobs(prefix=f"{job}/"):
+                try:
+                    blob.delete()
+                except Exception:
+                    pass
+
+    def translate_lines_multi(
+        self,
+        lines: List[str],
+        target_languages: Sequence[str],
+        source_language: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> Dict[str, List[str]]:
+        """Translate lines into several languages; sync wrapper over translate_lines_multi_async."""
+        return run_sync(
+            self.translate_lines_multi_async(lines, target_languages, source_language=source_language, model=model)
+        )
+
+    async def translate_lines_multi_async(
+        self,
+        lines: List[str],
+        target_languages: Sequence[str],
+        source_language: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> Dict[str, List[str]]:
+        # translate_text accepts a single target language, so fan out per language concurrently.
+        langs = list(dict.fromkeys(target_languages))
+        results = await asyncio.gather(
+            *(self.translate_lines_async(lines, lang, source_language=source_language, model=model) for lang in langs)
+        )
+        return dict(zip(langs, results))
+
+
+def _batchable(lines: List[str]) -> bool:
+    # The TSV input has one row per line, so tabs and newlines inside a line can't be sent.
+    return not any("\t" in ln or "\n" in ln for ln in lines)
 
 
 def _chunk_by_chars(items: List[str], max_chars: int = 80000, max_items: int = 256) -> List[List[str]]:
+    # Greedy packing planned on a length prefix-sum: each chunk ends at the last item that
+    # still fits max_chars (found by bisect in C), capped at max_items and never empty.
+    items = [it or "" for it in items]
+    csum = [0, *accumulate(map(len, items))]
     chunks: List[List[str]] = []
-    cur: List[str] = []
-    cur_len = 0
-    for it in items:
-        it_len = len(it or "")
-        if cur and (cur_len + it_len > max_chars or len(cur) >= max_items):
-            chunks.append(cur)
-            cur = []
-            cur_len = 0
-        cur.append(it or "")
-        cur_len += it_len
-    if cur:
-        chunks.append(cur)
+    start = 0
+    n = len(items)
+    while start < n:
+        fit = bisect_right(csum, csum[start] + max_chars, lo=start + 1) - 1
+        end = max(start + 1, min(fit, start + max_items))
+        chunks.append(items[start:end])
+        start = end
     return chunks
@@ -1,18 +1,24 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import os
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
 
 from dotenv import load_dotenv
 
-from ttml_translate import translate_ttml, write_ttml
+from ttml_translate import expand_lines, parse_ttml, render_translations, unique_lines, write_ttml
 from utils.gcs_utils import ensure_bucket, upload_file, resolve_project_id, expand_env
 from engines.gemini_engine import GeminiTranslator
 from engines.translate_llm_engine import CloudTranslateEngine
 
 
+# Items buffered between pipeline stages (bounds memory held by finished translations)
+PIPELINE_DEPTH = 2
+UPLOAD_WORKERS = 4
+
+
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Translate TTML subtitles using Gemini or Cloud Translation.")
     p.add_argument("-f", "--file", required=True, help="Path to input .ttml file")
@@ -27,6 +33,11 @@ def parse_args() -> argparse.Namespace:
         required=True,
         help="Comma-separated list of target language codes (e.g., 'es,fr,de')",
     )
+    p.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Store uploaded outputs gzip-compressed (Content-Encoding: gzip)",
+    )
     return p.parse_args()
 
 
@@ -34,7 +45,7 @@ def get_langs(spec: str) -> List[str]:
     return [x.strip() for x in spec.split(",") if x.strip()]
 
 
-def main() -> None:
+async def main() -> None:
     # Load .env and force the project to the .env PROJECT_ID for all downstream clients
     load_dotenv()
     project_id = os.environ.get("PROJECT_ID")
@@ -57,23 +68,9 @@ def main() -> None:
     if not langs:
         raise SystemExit("No target languages provided")
 
-    # Prepare engines and derive output labeling/paths
-    translate_fn_factory = None
+    # Prepare engine and derive output labeling/paths
     engine_label = "gemini" if args.engine == "gemini" else "translateLLM"
-    if args.engine == "gemini":
-        gem = GeminiTranslator()
-
-        def translate_fn(lines, lang):
-            return gem.translate_lines(lines, lang)
-
-        translate_fn_factory = translate_fn
-    else:
-        ct = CloudTranslateEngine()
-
-        def translate_fn(lines, lang):
-            return ct.translate_lines(lines, lang)
-
-        translate_fn_factory = translate_fn
+    engine = GeminiTranslator() if args.engine == "gemini" else CloudTranslateEngine()
 
     # Local output directory (engine-specific)
     local_out_dir = Path(f"translated_outputs_{engine_label}")
@@ -85,30 +82,78 @@ def main() -> None:
         raise SystemExit("BUCKET_NAME must be set in .env or environment")
     output_prefix = os.environ.get("OUTPUT_FOLDER", "output").strip("/")
 
-    # Ensure bucket exists (explicitly pass forced project_id)
-    gcs_bucket = ensure_bucket(bucket_name, location=os.environ.get("GCP_REGION"), project_id=project_id)
-
     in_stem = Path(input_path).stem
-    results: List[str] = []
-    gcs_results: List[str] = []
-
-    for lang in langs:
-        tree, count = translate_ttml(input_path, translate_fn_factory, lang)
-        # Include engine label in the filename for traceability
-        out_name = f"{in_stem}_{lang}_{engine_label}.ttml"
-        out_path = local_out_dir / out_name
-        write_ttml(tree, str(out_path))
-        results.append(str(out_path))
-
-        # Upload to GCS
-        gcs_uri = upload_file(str(out_path), gcs_bucket, object_name=out_name, prefix=output_prefix)
-        gcs_results.append(gcs_uri)
-        print(f"Translated {count} lines -> {out_path} | Uploaded: {gcs_uri}")
+
+    # Ensure bucket exists (explicitly pass forced project_id) and parse the input while the
+    # engine warms up its auth token and channel on this loop.
+    gcs_bucket, (tree, line_nodes, texts), _ = await asyncio.gather(
+        asyncio.to_thread(ensure_bucket, bucket_name, location=os.environ.get("GCP_REGION"), project_id=project_id),
+        asyncio.to_thread(parse_ttml, input_path),
+        engine.warmup_async(),
+    )
+
+    # Three-stage pipeline: translate -> write -> upload. While one language is being
+    # written, the previous one uploads; queues are bounded so stages can't run ahead.
+    translated_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+    written_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+    n_uploaders = max(1, min(UPLOAD_WORKERS, len(langs)))
+    # Uploads finish in any order; results are keyed by language and reported in -lang order.
+    outputs: Dict[str, Tuple[str, str]] = {}
+    failed: List[str] = []
+
+    async def translator_worker() -> None:
+        # Duplicates and empty/punctuation-only lines are collapsed before the API call;
+        # one request carries every language (Gemini), so languages arrive together.
+        keys, index = unique_lines(texts)
+        by_key = await engine.translate_lines_multi_async(keys, langs) if keys else {lang: [] for lang in langs}
+        for lang, arr in by_key.items():
+            await translated_q.put((lang, expand_lines(texts, index, arr)))
+        await translated_q.put(None)
+
+    async def writer_worker() -> None:
+        # Sole owner of the parsed tree: each language is applied and written before the next
+        while (item := await translated_q.get()) is not None:
+            lang, translated = item
+            for _, lang_tree, count in render_translations(tree, line_nodes, texts, {lang: translated}):
+                # Include engine label in the filename for traceability
+                out_name = f"{in_stem}_{lang}_{engine_label}.ttml"
+                await asyncio.to_thread(write_ttml, lang_tree, str(local_out_dir / out_name))
+                await written_q.put((lang, out_name, count))
+        for _ in range(n_uploaders):
+            await written_q.put(None)
+
+    async def uploader_worker() -> None:
+        while (item := await written_q.get()) is not None:
+            lang, out_name, count = item
+            out_path = local_out_dir / out_name
+            try:
+                uri = await asyncio.to_thread(
+                    upload_file,
+                    str(out_path),
+                    gcs_bucket,
+                    object_name=out_name,
+                    prefix=output_prefix,
+                    gzip_encoding=args.gzip,
+                )
+            except Exception as e:
+                print(f"[ERROR] Upload failed {out_path}: {e}")
+                failed.append(lang)
+                continue
+            print(f"Translated {count} lines -> {out_path} | Uploaded: {uri}")
+            outputs[lang] = (str(out_path), uri)
+
+    await asyncio.gather(translator_worker(), writer_worker(), *(uploader_worker() for _ in range(n_uploaders)))
 
     print("\nDone. Outputs:")
-    for p, u in zip(results, gcs_results):
-        print(f"- {p}  |  {u}")
+    for lang in dict.fromkeys(langs):
+        if lang in outputs:
+            p, u = outputs[lang]
+            print(f"- {p}  |  {u}")
+    if failed:
+        # Remaining uploads still finish; the exit status tells callers an output is missing
+        print(f"[ERROR] {len(failed)} upload(s) failed: {', '.join(failed)}")
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+from ttml_translate import apply_translations, parse_ttml
+
+
+TTML = """<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml">
+  <body>
+    <div>
+      <p><span>first</span><br/>folded<!-- note --><span>second</span></p>
+      <p><span>third</span><br/>own line</p>
+    </div>
+  </body>
+</tt>
+"""
+
+
+def _write(tmp_path, text):
+    path = tmp_path / "in.ttml"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_comment_between_br_and_span_keeps_br_tail_folded(tmp_path):
+    _, line_nodes, texts = parse_ttml(_write(tmp_path, TTML))
+    assert texts == ["first", "second", "third", "own line"]
+    assert line_nodes.count == 4
+
+
+def test_apply_translations_round_trip(tmp_path):
+    tree, line_nodes, texts = parse_ttml(_write(tmp_path, TTML))
+    assert apply_translations(line_nodes, [t.upper() for t in texts]) == 4
+    spans = [el.text for el in tree.iter("{http://www.w3.org/ns/ttml}span")]
+    assert spans == ["FIRST", "SECOND", "THIRD"]
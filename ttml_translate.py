@@ -2,8 +2,9 @@ from __future__ import annotations
 
 import os
 from pathlib import Path
-from typing import Callable, List, Tuple, Sequence
-import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Iterator, List, NamedTuple, Tuple, Sequence
+
+from lxml import etree as ET
 
 
 # Known namespaces used in the provided TTML
@@ -15,20 +16,31 @@ NS_EBUTTS = "urn:ebu:tt:style"
 NS_TTVA = "http://skynav.com/ns/ttv/annotations"
 
 
-def _register_namespaces():
-    ET.register_namespace("", NS_TT)
-    ET.register_namespace("tts", NS_TTS)
-    ET.register_namespace("ttm", NS_TTM)
-    ET.register_namespace("ttp", NS_TTP)
-    ET.register_namespace("ebutts", NS_EBUTTS)
-    ET.register_namespace("ttva", NS_TTVA)
+# lxml keeps each document's own namespace prefixes on write, so no registration is needed.
+
+
+def _parser() -> ET.XMLParser:
+    # Parsers are not shared across threads; entities stay unresolved as with ElementTree.
+    return ET.XMLParser(resolve_entities=False, no_network=True, remove_blank_text=False)
+
+
+def _read_tree(input_path: str) -> ET._ElementTree:
+    # Hand the path to libxml2, which reads the file itself: no Python-side bytes copy,
+    # and it works on every supported lxml (fromstring only accepts buffers from lxml 6).
+    return ET.parse(os.fspath(input_path), _parser())
 
 
 def _q(tag: str) -> str:
     return f"{{{NS_TT}}}{tag}"
 
 
-def collect_line_nodes(p_elem: ET.Element) -> List[Tuple[ET.Element, str]]:
+# Qualified tags built once. lxml returns a fresh str for every .tag, so compare with ==.
+_P_TAG = _q("p")
+_SPAN_TAG = _q("span")
+_BR_TAG = _q("br")
+
+
+def collect_line_nodes(p_elem: ET._Element) -> List[Tuple[ET._Element, str]]:
     """Collect all display lines under a <p> with robust handling of <span>, <br/>, and text tails.
 
     Returns a list of (node, attr) pairs where attr is either 'text' or 'tail'.
@@ -36,36 +48,166 @@ def collect_line_nodes(p_elem: ET.Element) -> List[Tuple[ET.Element, str]]:
     tail text (not wrapped in <span>), we treat that tail as a line.
     If the <p> has leading text (p.text) and no spans exist, that is treated as a line.
     """
-    lines: List[Tuple[ET.Element, str]] = []
+    lines: List[Tuple[ET._Element, str]] = []
+
+    # lxml filters the children by tag in C, so comments, processing instructions and other
+    # elements never reach Python. A <br/> tail is decided on the spot from the br's next
+    # element sibling, again skipping comments and PIs as ElementTree did.
+    has_spans = False
+    for ch in p_elem.iterchildren(_SPAN_TAG, _BR_TAG):
+        if ch.tag == _SPAN_TAG:
+            # Standard case: each span is a separate line
+            has_spans = True
+            lines.append((ch, "text"))
+        elif ch.tail and ch.tail.strip():
+            # Handle <br/> followed by tail text as a separate line when not immediately followed by a span
+            nxt = next(ch.itersiblings(ET.Element), None)
+            if nxt is None or nxt.tag != _SPAN_TAG:
+                lines.append((ch, "tail"))
+
+    # Leading text directly on <p> (rare in our inputs). Consider it a line when no spans exist;
+    # it precedes every child in document order.
+    if not has_spans and (p_elem.text and p_elem.text.strip()):
+        lines.insert(0, (p_elem, "text"))
 
-    has_spans = any(ch.tag == _q("span") for ch in list(p_elem))
+    return lines
 
-    # Leading text directly on <p> (rare in our inputs). Consider it a line when no spans exist.
-    if not has_spans and (p_elem.text and p_elem.text.strip()):
-        lines.append((p_elem, "text"))
 
-    children = list(p_elem)
-    for idx, ch in enumerate(children):
-        if ch.tag == _q("span"):
-            # Standard case: each span is a separate line
-            lines.append((ch, "text"))
+class LineNodes(NamedTuple):
+    """Translatable line slots of a document, split by attribute.
+
+    text_nodes[k] holds line text_idx[k] in its .text, tail_nodes[k] holds line
+    tail_idx[k] in its .tail; indexes are positions in document order. Keeping
+    the two kinds apart lets reads and writes use plain attribute access.
+    """
+
+    text_nodes: List[ET._Element]
+    text_idx: List[int]
+    tail_nodes: List[ET._Element]
+    tail_idx: List[int]
+    count: int
+
+
+def parse_ttml(input_path: str) -> Tuple[ET._ElementTree, LineNodes, List[str]]:
+    """Parse a TTML file and collect its translatable lines.
+
+    Returns the ElementTree, the line slots (LineNodes), and the current text
+    of each line in document order (empty string when unset).
+    """
+    tree = _read_tree(input_path)
+
+    # Collect all line nodes in document order; collect_line_nodes holds the line rules.
+    text_nodes: List[ET._Element] = []
+    text_idx: List[int] = []
+    tail_nodes: List[ET._Element] = []
+    tail_idx: List[int] = []
+    count = 0
+    for p in tree.iter(_P_TAG):
+        for node, attr in collect_line_nodes(p):
+            if attr == "text":
+                text_nodes.append(node)
+                text_idx.append(count)
+            else:
+                tail_nodes.append(node)
+                tail_idx.append(count)
+            count += 1
+
+    texts = [""] * count
+    for node, i in zip(text_nodes, text_idx):
+        texts[i] = node.text or ""
+    for node, i in zip(tail_nodes, tail_idx):
+        texts[i] = node.tail or ""
+
+    return tree, LineNodes(text_nodes, text_idx, tail_nodes, tail_idx, count), texts
+
+
+def apply_translations(line_nodes: LineNodes, translated: Sequence[str]) -> int:
+    """Write translated lines back onto their nodes in place.
+
+    Nothing is written when the translation count does not match the line count,
+    so alignment is never corrupted. Returns the number of lines written.
+    """
+    if not line_nodes.count or len(translated) != line_nodes.count:
+        return 0
+    for node, i in zip(line_nodes.text_nodes, line_nodes.text_idx):
+        node.text = translated[i]
+    for node, i in zip(line_nodes.tail_nodes, line_nodes.tail_idx):
+        node.tail = translated[i]
+    return line_nodes.count
+
+
+def _needs_translation(key: str) -> bool:
+    # Empty, whitespace-only and punctuation/symbol-only lines ("...", "♪", "—") pass through.
+    return any(ch.isalnum() for ch in key)
+
+
+def unique_lines(texts: Sequence[str]) -> Tuple[List[str], List[int]]:
+    """Collapse texts to the distinct stripped lines that actually need translating.
+
+    Returns the unique keys in first-seen order and, per text, the index of its
+    key or -1 when the text passes through unchanged.
+    """
+    pos: Dict[str, int] = {}
+    index: List[int] = []
+    for t in texts:
+        key = t.strip()
+        if not _needs_translation(key):
+            index.append(-1)
             continue
-        # Handle <br/> followed by tail text as a separate line when not immediately followed by a span
-        if ch.tag == _q("br"):
-            # If next sibling is a span, that span will be captured as its own line
-            if ch.tail and ch.tail.strip():
-                next_is_span = (idx + 1 < len(children) and children[idx + 1].tag == _q("span"))
-                if not next_is_span:
-                    lines.append((ch, "tail"))
+        i = pos.get(key)
+        if i is None:
+            i = pos[key] = len(pos)
+        index.append(i)
+    return list(pos), index
 
-    return lines
+
+def expand_lines(texts: Sequence[str], index: Sequence[int], translated: Sequence[str]) -> List[str]:
+    """Scatter translations of unique keys back onto every text, keeping its padding.
+
+    Returns [] when the translation count does not match the key count, which
+    apply_translations treats as a mismatch.
+    """
+    if len(translated) != (max(index) + 1 if index else 0):
+        return []
+    out: List[str] = []
+    for t, i in zip(texts, index):
+        if i < 0:
+            out.append(t)
+            continue
+        key = t.strip()
+        if key == t:
+            out.append(translated[i])
+        else:
+            start = t.index(key)
+            out.append(t[:start] + translated[i] + t[start + len(key):])
+    return out
+
+
+def render_translations(
+    tree: ET._ElementTree,
+    line_nodes: LineNodes,
+    texts: List[str],
+    translations: Dict[str, Sequence[str]],
+) -> Iterator[Tuple[str, ET._ElementTree, int]]:
+    """Apply precomputed per-language translations to a single parsed tree.
+
+    Yields (lang, tree, translated_line_count) for each language. The same tree
+    is rewritten for every language, so write it out before advancing the
+    iterator. Languages whose translation count does not match are yielded
+    with the source text restored and a count of 0.
+    """
+    for lang, translated in translations.items():
+        count = apply_translations(line_nodes, translated)
+        if not count:
+            apply_translations(line_nodes, texts)
+        yield lang, tree, count
 
 
 def translate_ttml(
     input_path: str,
     translate_fn: Callable[[List[str], str], List[str]],
     target_language: str,
-) -> Tuple[ET.ElementTree, int]:
+) -> Tuple[ET._ElementTree, int]:
     """Translate TTML subtitle text while preserving structure.
 
     Batched translation across the entire document to minimize API calls and
@@ -74,32 +216,18 @@ def translate_ttml(
 
     Returns the modified ElementTree and a count of translated lines.
     """
-    _register_namespaces()
-    tree = ET.parse(input_path)
-    root = tree.getroot()
-
-    # Collect all line nodes in document order
-    line_nodes: List[Tuple[ET.Element, str]] = []
-    for p in root.findall(f".//{_q('p')}"):
-        line_nodes.extend(collect_line_nodes(p))
-
-    texts: List[str] = []
-    for node, attr in line_nodes:
-        val = getattr(node, attr, None)
-        texts.append(val or "")
+    tree, line_nodes, texts = parse_ttml(input_path)
 
     total_lines = 0
+    keys, index = unique_lines(texts)
     if texts:
-        translated = translate_fn(texts, target_language)
-        if len(translated) == len(line_nodes):
-            for (node, attr), txt in zip(line_nodes, translated):
-                setattr(node, attr, txt)
-            total_lines = len(line_nodes)
+        # Duplicates and pass-through lines never reach translate_fn
+        translated = translate_fn(keys, target_language) if keys else []
+        total_lines = apply_translations(line_nodes, expand_lines(texts, index, translated))
 
     return tree, total_lines
 
 
-def write_ttml(tree: ET.ElementTree, output_path: str) -> None:
-    _register_namespaces()
+def write_ttml(tree: ET._ElementTree, output_path: str) -> None:
     Path(os.path.dirname(output_path) or ".").mkdir(parents=True, exist_ok=True)
-    tree.write(output_path, encoding="utf-8", xml_declaration=True)
+    tree.write(output_path, encoding="utf-8", xml_declaration=True, pretty_print=False)
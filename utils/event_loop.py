@@ -0,0 +1,24 @@
+import asyncio
+import os
+import threading
+from typing import Coroutine, TypeVar
+
+
+T = TypeVar("T")
+
+_LOCAL = threading.local()
+
+
+def run_sync(coro: Coroutine[object, object, T]) -> T:
+    """Run coro to completion on this thread's long-lived event loop.
+
+    Unlike asyncio.run, the loop survives between calls, so per-loop handles
+    (Vertex models, async Translation clients, semaphores) created by the first
+    sync call are reused by every later one from the same thread. A forked
+    worker process starts its own loop instead of inheriting the parent's.
+    """
+    loop = getattr(_LOCAL, "loop", None)
+    if loop is None or loop.is_closed() or _LOCAL.pid != os.getpid():
+        loop = _LOCAL.loop = asyncio.new_event_loop()
+        _LOCAL.pid = os.getpid()
+    return loop.run_until_complete(coro)
@@ -1,13 +1,25 @@
+import functools
+import gzip
+import io
+import mimetypes
 import os
-from typing import Optional
+from typing import List, Optional, Sequence, Set, Tuple, Union
 
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
+from google.api_core.exceptions import PreconditionFailed
 import google.auth
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
+mimetypes.add_type("application/ttml+xml", ".ttml")
+mimetypes.add_type("text/vtt", ".vtt")
+
+# (bucket_name, prefix) pairs whose folder placeholder is known to exist.
+_ENSURED_PREFIXES: Set[Tuple[str, str]] = set()
+
 
 def expand_env(value: Optional[str]) -> Optional[str]:
     if value is None:
@@ -25,6 +37,19 @@ def resolve_project_id() -> Optional[str]:
     return pid
 
 
+@functools.lru_cache(maxsize=None)
+def get_client(project_id: str) -> storage.Client:
+    """Return the process-wide storage client for project_id (one connection pool and token refresh)."""
+    # Use credentials with quota project override when available
+    creds, _ = google.auth.default()
+    if hasattr(creds, "with_quota_project"):
+        try:
+            creds = creds.with_quota_project(project_id)
+        except Exception:
+            pass
+    return storage.Client(project=project_id, credentials=creds)
+
+
 def ensure_bucket(bucket_name: str, location: Optional[str] = None, project_id: Optional[str] = None) -> storage.Bucket:
     """Get or create a GCS bucket.
 
@@ -37,14 +62,7 @@ def ensure_bucket(bucket_name: str, location: Optional[str] = None, project_id:
     if not project_id:
         raise ValueError("PROJECT_ID is not set. Ensure .env is loaded or environment is configured.")
 
-    # Use credentials with quota project override when available
-    creds, _ = google.auth.default()
-    if hasattr(creds, "with_quota_project"):
-        try:
-            creds = creds.with_quota_project(project_id)
-        except Exception:
-            pass
-    client = storage.Client(project=project_id, credentials=creds)
+    client = get_client(project_id)
     bucket = client.bucket(bucket_name)
     try:
         bucket.reload()
@@ -64,10 +82,33 @@ def ensure_prefix(bucket: storage.Bucket, prefix: str) -> None:
     """
     if not prefix:
         return
+    key = (bucket.name, prefix)
+    if key in _ENSURED_PREFIXES:
+        return
     placeholder = f"{prefix.rstrip('/')}/"
     blob = bucket.blob(placeholder)
-    if not blob.exists():
-        blob.upload_from_string(b"")
+    # Create-if-absent in one request; 412 means the placeholder is already there
+    try:
+        blob.upload_from_string(b"", if_generation_match=0)
+    except PreconditionFailed:
+        pass
+    _ENSURED_PREFIXES.add(key)
+
+
+def list_object_names(bucket: storage.Bucket, prefix: Optional[str] = None) -> Set[str]:
+    """Return the names of all objects under prefix with one paginated listing."""
+    list_prefix = f"{prefix.rstrip('/')}/" if prefix else None
+    return {blob.name for blob in bucket.list_blobs(prefix=list_prefix)}
+
+
+def _gzip_buffer(local_path: str, blob: storage.Blob) -> io.BytesIO:
+    # Stored gzip-encoded with the real content type; GCS decompresses for clients
+    # that don't send Accept-Encoding: gzip.
+    with open(local_path, "rb") as f:
+        data = gzip.compress(f.read())
+    blob.content_encoding = "gzip"
+    blob.content_type = mimetypes.guess_type(local_path)[0] or "application/octet-stream"
+    return io.BytesIO(data)
 
 
 def upload_file(
@@ -75,11 +116,74 @@ def upload_file(
     bucket: storage.Bucket,
     object_name: Optional[str] = None,
     prefix: Optional[str] = None,
+    gzip_encoding: bool = False,
 ) -> str:
     base = os.path.basename(local_path)
     key = f"{prefix.rstrip('/')}/{object_name or base}" if prefix else (object_name or base)
     if prefix:
         ensure_prefix(bucket, prefix)
     blob = bucket.blob(key)
-    blob.upload_from_filename(local_path)
+    if gzip_encoding:
+        blob.upload_from_file(_gzip_buffer(local_path, blob), rewind=True)
+    else:
+        blob.upload_from_filename(local_path)
     return f"gs://{bucket.name}/{key}"
+
+
+def _running_on_gce() -> bool:
+    # GCE, GKE, and Cloud Run hosts report a Google product name via DMI.
+    try:
+        with open("/sys/class/dmi/id/product_name", encoding="utf-8") as f:
+            return "Google" in f.read()
+    except OSError:
+        return False
+
+
+def upload_many(
+    filenames: Sequence[str],
+    bucket: storage.Bucket,
+    source_directory: str = "",
+    prefix: Optional[str] = None,
+    max_workers: int = 16,
+    gzip_encoding: bool = False,
+    use_threads: bool = False,
+) -> List[Union[str, Exception]]:
+    """Upload many local files in parallel via transfer_manager.
+
+    - filenames are relative to source_directory and keep their names in GCS.
+    - Uses worker processes to avoid GIL/client contention; threads on GCE,
+      where fork overhead outweighs it. use_threads forces threads, e.g. from a
+      process that already holds gRPC channels, which are not fork-safe.
+    - gzip_encoding stores each object gzip-compressed (Content-Encoding: gzip);
+      the in-memory buffers cannot be pickled, so this always uses threads.
+    - Returns, per file, its gs:// URI or the exception raised for it.
+    """
+    if not filenames:
+        return []
+    if prefix:
+        ensure_prefix(bucket, prefix)
+    blob_prefix = f"{prefix.rstrip('/')}/" if prefix else ""
+    if gzip_encoding:
+        pairs = []
+        for name in filenames:
+            blob = bucket.blob(blob_prefix + name)
+            pairs.append((_gzip_buffer(os.path.join(source_directory, name), blob), blob))
+        results = transfer_manager.upload_many(
+            pairs,
+            max_workers=max_workers,
+            worker_type=transfer_manager.THREAD,
+        )
+    else:
+        worker_type = transfer_manager.THREAD if use_threads or _running_on_gce() else transfer_manager.PROCESS
+        results = transfer_manager.upload_many_from_filenames(
+            bucket,
+            list(filenames),
+            source_directory=source_directory,
+            blob_name_prefix=blob_prefix,
+            max_workers=max_workers,
+            worker_type=worker_type,
+        )
+    return [
+        res if isinstance(res, Exception) else f"gs://{bucket.name}/{blob_prefix}{name}"
+        for name, res in zip(filenames, results)
+    ]
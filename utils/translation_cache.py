@@ -0,0 +1,56 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "gemini_tr.sqlite3")
+# Cloud Translation keeps its own file so the engines never contend for one WAL database.
+TRANSLATE_CACHE_PATH = os.path.join(".cache", "translate_tr.sqlite3")
+
+# SQLite caps bound parameters per statement; stay well below the oldest limit (999).
+_MAX_PARAMS = 500
+
+
+class TranslationCache:
+    """Persistent (model, language, line) -> translation store backed by SQLite.
+
+    Survives process restarts so repeated lines across episodes and reruns skip
+    the model entirely. Safe to share across threads; multiple processes may
+    point at the same file.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH) -> None:
+        self.path = path
+        Path(os.path.dirname(path) or ".").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS translations (key BLOB PRIMARY KEY, value TEXT NOT NULL)")
+
+    @staticmethod
+    def key(model: str, target_language: str, line: str) -> bytes:
+        return hashlib.sha256(f"{model}|{target_language}|{line}".encode("utf-8")).digest()
+
+    def get_many(self, model: str, target_language: str, lines: Sequence[str]) -> List[Optional[str]]:
+        """Return the cached translation for each line, or None where missing."""
+        keys = [self.key(model, target_language, ln) for ln in lines]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                batch = keys[start:start + _MAX_PARAMS]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, value FROM translations WHERE key IN ({marks})", batch)
+                found.update(rows.fetchall())
+        return [found.get(k) for k in keys]
+
+    def set_many(self, model: str, target_language: str, pairs: Iterable[Tuple[str, str]]) -> None:
+        """Store (source_line, translation) pairs."""
+        rows = [(self.key(model, target_language, src), dst) for src, dst in pairs]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO translations (key, value) VALUES (?, ?)", rows)